@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xml_to_json.py Benchmark
+Generates synthetic worlds of increasing size and runs the converter on them, reporting wall time
+per stage (from its run_report.json) and peak RSS so the slow (O(n^2)) paths show up right away
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from generate_synthetic_legends import WorldSize, generate_world
+
+# name -> (hfs, events)
+SIZES = {
+    'tiny': (100, 1000),
+    'small': (1000, 10000),
+    'medium': (10000, 100000),
+    'large': (100000, 1000000),
+}
+
+
+def run_stages(files_path, json_path, workers):
+    # runs in a fresh process so peak RSS belongs to this world only. the converter measures its own stages
+    import xml_to_json as converter
+
+    converter.run_pipeline(files_path, json_path, workers=workers, use_cache=False)
+    with open(os.path.join(json_path, 'run_report.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def benchmark_size(name, work_path, workers):
+    hfs, events = SIZES[name]
+    files_path = os.path.join(work_path, name, 'files')
+    json_path = os.path.join(files_path, 'jsons')
+    print(f"== {name}: {hfs} hfs, {events} events")
+    start = time.perf_counter()
+    generate_world(files_path, WorldSize(hfs, events))
+    print(f"   generated in {time.perf_counter() - start:.1f}s")
+    os.makedirs(json_path, exist_ok=True)
+
+    # the converter prints a lot, keep it out of the report
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-one', files_path, json_path, '--workers', str(workers)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if child.returncode != 0:
+        print(child.stdout[-2000:])
+        print(child.stderr[-4000:])
+        raise SystemExit(f"converter failed on the {name} world")
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    events_per_second = [t['events_per_second'] for t in result['stages'] if 'events_per_second' in t]
+    result.update({'size': name, 'hfs': hfs, 'events': events, 'events_per_second': events_per_second[0] if events_per_second else None,
+                   'input_mb': round(sum(os.path.getsize(os.path.join(files_path, f)) for f in os.listdir(files_path)
+                                         if os.path.isfile(os.path.join(files_path, f))) / (1024 * 1024), 1)})
+    return result
+
+
+def print_report(results):
+    stage_names = [t['stage'] for t in results[0]['stages'] if t['stage'] != 'hash inputs']
+    header = f"{'size':<8}{'input MB':>10}" + "".join(f"{s:>20}" for s in stage_names) + f"{'total':>10}{'events/s':>10}{'peak MB':>10}"
+    print(header)
+    for result in results:
+        seconds = [t['wall_seconds'] for t in result['stages'] if t['stage'] != 'hash inputs']
+        rss = result['peak_rss_mb']
+        print(f"{result['size']:<8}{result['input_mb']:>10}" + "".join(f"{s:>20.3f}" for s in seconds)
+              + f"{sum(seconds):>10.2f}{result['events_per_second'] or '-':>10}" + (f"{rss:>10.0f}" if rss is not None else f"{'-':>10}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark xml_to_json.py on synthetic worlds")
+    parser.add_argument('--sizes', default='tiny,small,medium',
+                        help=f"comma separated, any of {', '.join(SIZES)} (default tiny,small,medium)")
+    parser.add_argument('--workers', type=int, default=1, help="passed on to the event translation")
+    parser.add_argument('--work-dir', default=None, help="where to generate the worlds (default: a temp dir, removed afterwards)")
+    parser.add_argument('--report', default=None, help="also write the results as json to this file")
+    parser.add_argument('--run-one', nargs=2, metavar=('FILES_PATH', 'JSON_PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_stages(args.run_one[0], args.run_one[1], args.workers)
+        print(json.dumps(result))
+        return
+
+    work_path = args.work_dir or tempfile.mkdtemp(prefix='ktown-bench-')
+    try:
+        results = [benchmark_size(name.strip(), work_path, args.workers) for name in args.sizes.split(',')]
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_path, ignore_errors=True)
+    print_report(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
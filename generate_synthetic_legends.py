@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic Legends Generator
+Writes a fake legends.xml, legends_plus.xml and enhanced_books.json with the same tag layout
+xml_to_json.py reads, so the converter can be run (and benchmarked) without a real Dwarf Fortress export
+"""
+
+import os
+import json
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+from xml_to_json import EVENTS_HF_ID, SITE_WC_EVENTS
+
+SITE_TYPES = ["hamlet", "fortress", "cave", "dark fortress", "forest retreat", "town", "tower", "lair"]
+STRUCTURE_TYPES = ["temple", "library", "tavern", "market", "mead hall", "tomb", "keep"]
+RACES = ["DWARF", "HUMAN", "ELF", "GOBLIN", "KOBOLD", "DRAGON", "CAT"]
+REGION_TYPES = ["Grassland", "Mountains", "Forest", "Ocean", "Desert", "Wetland", "Tundra"]
+SYLLABLES = ["ur", "ist", "bom", "rek", "the", "oth", "ald", "sin", "kol", "mes", "zan", "dum", "ith", "a"]
+# events the converter doesnt have a string for yet, they still get linked to hfs and sites
+UNKNOWN_EVENT_TYPES = ["masterpiece item", "artifact created", "hf travel", "item stolen"]
+
+
+def make_name(rng, words=2):
+    # every now and then a doubled article, like the real exports love to do
+    parts = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) for _ in range(words)]
+    if rng.random() < 0.05:
+        parts.insert(0, "the the")
+    return " ".join(parts)
+
+
+def tag(name, value):
+    return f"<{name}>{escape(str(value))}</{name}>"
+
+
+class WorldSize:
+    """How many of each record to generate."""
+
+    def __init__(self, hfs, events, sites=None, structures_per_site=3, artifacts=None, written_contents=None,
+                 regions=None, entities=None, world_size=129):
+        self.hfs = hfs
+        self.events = events
+        self.sites = sites or max(hfs // 10, 3)
+        self.structures_per_site = structures_per_site
+        self.written_contents = written_contents or max(hfs // 2, 1)
+        self.artifacts = artifacts or self.written_contents
+        self.regions = regions or max(self.sites // 20, 2)
+        self.entities = entities or max(self.sites // 5, 1)
+        self.world_size = world_size
+
+
+def region_cells(size, regions):
+    # split the world grid into horizontal bands, one per region
+    cells = [[] for _ in range(regions)]
+    for y in range(size.world_size):
+        band = y * regions // size.world_size
+        for x in range(size.world_size):
+            cells[band].append(f"{x},{y}")
+    return cells
+
+
+def event_value(rng, key, size):
+    if 'hfid' in key or 'hf_id' in key:
+        return rng.randrange(size.hfs)
+    if 'site' in key:
+        return rng.randrange(1, size.sites + 1)
+    if 'wc' in key or 'written_content' in key:
+        return rng.randrange(size.written_contents)
+    return rng.randrange(100)
+
+
+def write_legends(path, size, rng):
+    event_types = list(EVENTS_HF_ID.items()) + list(SITE_WC_EVENTS.items())
+    with open(path, 'w', encoding='cp437', errors='replace') as f:
+        f.write("<?xml version=\"1.0\" encoding='CP437'?>\n<df_world>\n")
+
+        f.write("<regions>\n")
+        for region_id in range(size.regions):
+            f.write(f"<region>{tag('id', region_id)}{tag('name', make_name(rng))}{tag('type', rng.choice(REGION_TYPES))}</region>\n")
+        f.write("</regions>\n<underground_regions>\n")
+        for region_id in range(size.regions):
+            f.write(f"<underground_region>{tag('id', region_id)}{tag('type', 'cavern')}{tag('depth', rng.randint(1, 3))}</underground_region>\n")
+        f.write("</underground_regions>\n<sites>\n")
+        for site_id in range(1, size.sites + 1):
+            x, y = rng.randrange(size.world_size), rng.randrange(size.world_size)
+            structures = "".join(
+                f"<structure>{tag('local_id', local_id)}{tag('type', rng.choice(STRUCTURE_TYPES))}{tag('name', make_name(rng))}</structure>"
+                for local_id in range(size.structures_per_site))
+            f.write(f"<site>{tag('id', site_id)}{tag('type', rng.choice(SITE_TYPES))}{tag('name', make_name(rng))}"
+                    f"{tag('coords', f'{x},{y}')}{tag('rectangle', f'{x*16},{y*16}:{x*16+15},{y*16+15}')}"
+                    f"<structures>{structures}</structures></site>\n")
+        f.write("</sites>\n<world_constructions></world_constructions>\n<artifacts>\n")
+
+        for artifact_id in range(size.artifacts):
+            wc_field = rng.choice(['writing_written_content_id', 'page_written_content_id'])
+            item = f"<item>{tag('name_string', make_name(rng))}{tag(wc_field, artifact_id % size.written_contents)}</item>"
+            placement = rng.random()
+            site_id = rng.randrange(1, size.sites + 1)
+            if placement < 0.4:
+                where = tag('site_id', site_id) + tag('holder_hfid', rng.randrange(size.hfs))
+            elif placement < 0.7:
+                where = tag('site_id', site_id) + tag('structure_local_id', rng.randrange(size.structures_per_site))
+            else:
+                where = tag('site_id', site_id)
+            f.write(f"<artifact>{tag('id', artifact_id)}{tag('name', make_name(rng))}{where}{item}</artifact>\n")
+        f.write("</artifacts>\n<historical_figures>\n")
+
+        for hfid in range(size.hfs):
+            links = ""
+            link_kind = rng.random()
+            if link_kind < 0.3:
+                links = f"<site_link>{tag('link_type', 'home site building')}{tag('site_id', rng.randrange(1, size.sites + 1))}</site_link>"
+            elif link_kind < 0.8:
+                links = "".join(
+                    f"<entity_link>{tag('link_type', rng.choice(['member', 'enemy', 'former member']))}{tag('entity_id', rng.randrange(size.entities))}</entity_link>"
+                    for _ in range(rng.randint(1, 3)))
+            skills = "".join(f"<hf_skill>{tag('skill', 'MINING')}{tag('total_ip', rng.randrange(5000))}</hf_skill>" for _ in range(3))
+            f.write(f"<historical_figure>{tag('id', hfid)}{tag('name', make_name(rng))}{tag('race', rng.choice(RACES))}"
+                    f"{tag('caste', 'FEMALE')}{tag('birth_year', rng.randrange(-100, 100))}{links}{skills}</historical_figure>\n")
+        f.write("</historical_figures>\n<entity_populations></entity_populations>\n<entities>\n")
+        for entity_id in range(size.entities):
+            f.write(f"<entity>{tag('id', entity_id)}{tag('name', make_name(rng))}</entity>\n")
+        f.write("</entities>\n<historical_events>\n")
+
+        year = 1
+        for event_id in range(size.events):
+            if rng.random() < 0.01:
+                year += 1
+            fields = tag('id', event_id) + tag('year', year) + tag('seconds72', rng.randrange(403200))
+            if rng.random() < 0.2:
+                event_type = rng.choice(UNKNOWN_EVENT_TYPES)
+                keys = ['hfid', 'site_id']
+            else:
+                event_type, keys = rng.choice(event_types)
+            fields += tag('type', event_type)
+            for key in keys:
+                fields += tag(key, event_value(rng, key, size))
+            fields += tag('subregion_id', -1) + tag('feature_layer_id', -1)
+            f.write(f"<historical_event>{fields}</historical_event>\n")
+
+        f.write("</historical_events>\n<historical_event_collections></historical_event_collections>\n<historical_eras></historical_eras>\n<written_contents>\n")
+        for wc_id in range(size.written_contents):
+            f.write(f"<written_content>{tag('id', wc_id)}{tag('title', make_name(rng, 3))}{tag('author_hfid', rng.randrange(size.hfs))}</written_content>\n")
+        f.write("</written_contents>\n<poetic_forms></poetic_forms>\n</df_world>\n")
+
+
+def write_legends_plus(path, size, rng):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version=\"1.0\" encoding='UTF-8'?>\n<df_world>\n")
+        f.write(f"{tag('name', make_name(rng))}\n{tag('altname', make_name(rng))}\n<regions>\n")
+        for region_id, cells in enumerate(region_cells(size, size.regions)):
+            f.write(f"<region>{tag('id', region_id)}{tag('coords', '|'.join(cells))}{tag('evilness', 'neutral')}</region>\n")
+        f.write("</regions>\n<underground_regions>\n")
+        for region_id, cells in enumerate(region_cells(size, size.regions)):
+            f.write(f"<underground_region>{tag('id', region_id)}{tag('coords', '|'.join(cells[::7]))}</underground_region>\n")
+        f.write("</underground_regions>\n<sites>\n")
+        for site_id in range(1, size.sites + 1):
+            structures = ""
+            for local_id in range(size.structures_per_site):
+                inhabitants = "".join(tag('inhabitant', rng.randrange(size.hfs)) for _ in range(rng.choice([0, 0, 1, 2])))
+                structures += f"<structure>{tag('id', local_id)}{tag('type', rng.choice(STRUCTURE_TYPES))}{tag('name', make_name(rng))}{inhabitants}</structure>"
+            f.write(f"<site>{tag('id', site_id)}{tag('civ_id', rng.randrange(size.entities))}"
+                    f"{tag('cur_owner_id', rng.randrange(size.entities))}<structures>{structures}</structures></site>\n")
+        f.write("</sites>\n<historical_figures>\n")
+        for hfid in range(size.hfs):
+            f.write(f"<historical_figure>{tag('id', hfid)}{tag('sex', rng.randint(0, 1))}</historical_figure>\n")
+        f.write("</historical_figures>\n</df_world>\n")
+
+
+def write_books(path, size, rng):
+    data = {}
+    for wc_id in range(size.written_contents):
+        data[str(wc_id)] = {
+            'written_content_id': wc_id,
+            'author_hfid': rng.randrange(size.hfs),
+            'title': make_name(rng, 3),
+            'text_content': " ".join(make_name(rng, 1) for _ in range(rng.randint(20, 200))),
+        }
+    # and a few books that dont match any artifact or placed author
+    for extra in range(max(size.written_contents // 50, 1)):
+        data[f"orphan{extra}"] = {'written_content_id': size.written_contents + extra, 'author_hfid': -1,
+                                  'title': make_name(rng, 3), 'text_content': ""}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'data': data}, f, ensure_ascii=False)
+
+
+def generate_world(files_path, size, seed=0):
+    os.makedirs(files_path, exist_ok=True)
+    rng = random.Random(seed)
+    write_legends(os.path.join(files_path, 'region1-00250-01-01-legends.xml'), size, rng)
+    write_legends_plus(os.path.join(files_path, 'region1-00250-01-01-legends_plus.xml'), size, rng)
+    write_books(os.path.join(files_path, 'enhanced_books.json'), size, rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write a synthetic legends.xml, legends_plus.xml and enhanced_books.json")
+    parser.add_argument('files_path', help="folder to write the three files into (the converter reads files/)")
+    parser.add_argument('--hfs', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--sites', type=int, default=None, help="default: hfs / 10")
+    parser.add_argument('--structures-per-site', type=int, default=3)
+    parser.add_argument('--artifacts', type=int, default=None, help="default: same as written contents")
+    parser.add_argument('--written-contents', type=int, default=None, help="default: hfs / 2")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    size = WorldSize(args.hfs, args.events, sites=args.sites, structures_per_site=args.structures_per_site,
+                     artifacts=args.artifacts, written_contents=args.written_contents)
+    generate_world(args.files_path, size, args.seed)
+    print(f"wrote a world with {size.hfs} hfs, {size.sites} sites, {size.events} events to {args.files_path}")
+
+
+if __name__ == "__main__":
+    main()
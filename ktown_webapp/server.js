@@ -1,6 +1,9 @@
 const express = require("express");
 const path = require("path");
 const fs = require("fs");
+const crypto = require("crypto");
+const zlib = require("zlib");
+const { promisify } = require("util");
 const cors = require("cors");
 const { chain } = require("stream-chain");
 const { parser } = require("stream-json");
@@ -12,9 +15,124 @@ app.use(cors());
 app.use(express.json({ limit: "500mb" })); // Increased limit for large JSON files
 
 const world_data_location = "big/queen.json";
+// map grid written by xml_to_json.py next to queen.json, optional
+const cells_data_location = "big/cells.json";
 
 // Serve public directory (for queen.json)
 const PUBLIC_DIR = path.join(__dirname, "public");
+
+// ---------- Precompressed json: xml_to_json.py writes queen.json.gz (and .br) next to queen.json ----------
+// sent as they are with a Content-Encoding, so nothing gets compressed per request. preferred order: br, gzip
+const PRECOMPRESSED = [
+  { encoding: "br", extension: ".br" },
+  { encoding: "gzip", extension: ".gz" },
+];
+
+function acceptsEncoding(req, encoding) {
+  const header = req.headers["accept-encoding"] || "";
+  return header.split(",").some((part) => {
+    const [name, ...params] = part.trim().split(";");
+    if (name.trim().toLowerCase() !== encoding) return false;
+    const q = params.find((p) => p.trim().startsWith("q="));
+    return !q || parseFloat(q.trim().slice(2)) > 0;
+  });
+}
+
+function statOrNull(filePath) {
+  try {
+    return fs.statSync(filePath);
+  } catch (err) {
+    return null;
+  }
+}
+
+// sha256 of a file, kept until its size or mtime change (so a copied file gets hashed once more)
+const fileDigests = new Map(); // filePath -> { version, digest }
+
+function fileDigest(filePath, stat) {
+  const version = `${stat.size}-${stat.mtimeMs}`;
+  const cached = fileDigests.get(filePath);
+  if (cached && cached.version === version) return cached.digest;
+
+  const digest = new Promise((resolve, reject) => {
+    const hash = crypto.createHash("sha256");
+    fs.createReadStream(filePath)
+      .on("error", reject)
+      .on("data", (block) => hash.update(block))
+      .on("end", () => resolve(hash.digest("hex")));
+  });
+  fileDigests.set(filePath, { version, digest });
+  digest.catch(() => {
+    if (fileDigests.get(filePath)?.digest === digest) fileDigests.delete(filePath);
+  });
+  return digest;
+}
+
+// <file>.json.sha256 is written by xml_to_json.py with the variants, in sha256sum format
+function readPrecompressedSums(filePath) {
+  let text;
+  try {
+    text = fs.readFileSync(filePath + ".sha256", "utf8");
+  } catch (err) {
+    return null;
+  }
+  const sums = new Map();
+  for (const line of text.split("\n")) {
+    const match = line.match(/^([0-9a-f]{64}) [ *](.+)$/);
+    if (match) sums.set(match[2], match[1]);
+  }
+  return sums;
+}
+
+// sends filePath.br / filePath.gz if the client takes it, resolves false when there is no usable variant.
+// a variant is only used when the json and the variant still have the sums they were written with, file times
+// say nothing after a plain cp
+async function sendPrecompressed(req, res, filePath, next) {
+  const jsonStat = statOrNull(filePath);
+  const sums = jsonStat && readPrecompressedSums(filePath);
+  const name = path.basename(filePath);
+  if (!sums || !sums.has(name)) return false;
+  if ((await fileDigest(filePath, jsonStat)) !== sums.get(name)) return false;
+
+  for (const { encoding, extension } of PRECOMPRESSED) {
+    if (!acceptsEncoding(req, encoding)) continue;
+    const stat = statOrNull(filePath + extension);
+    const expected = sums.get(name + extension);
+    if (!stat || !expected || (await fileDigest(filePath + extension, stat)) !== expected) continue;
+
+    const etag = `"${encoding}-${expected.slice(0, 32)}"`;
+    res.setHeader("Vary", "Accept-Encoding");
+    res.setHeader("ETag", etag);
+    res.setHeader("Cache-Control", "no-cache"); // always revalidate, a 304 is cheap
+    if (req.headers["if-none-match"] === etag) {
+      res.status(304).end();
+      return true;
+    }
+    res.setHeader("Content-Type", "application/json; charset=utf-8");
+    res.setHeader("Content-Encoding", encoding);
+    res.setHeader("Content-Length", stat.size);
+    if (req.method === "HEAD") {
+      res.end();
+      return true;
+    }
+    fs.createReadStream(filePath + extension).on("error", next).pipe(res);
+    return true;
+  }
+  return false;
+}
+
+function servePrecompressed(req, res, next) {
+  if ((req.method !== "GET" && req.method !== "HEAD") || !req.path.endsWith(".json")) {
+    return next();
+  }
+  const filePath = path.join(PUBLIC_DIR, decodeURIComponent(req.path));
+  if (!filePath.startsWith(PUBLIC_DIR + path.sep)) return next();
+  sendPrecompressed(req, res, filePath, next).then((sent) => {
+    if (!sent) next();
+  }, next);
+}
+
+app.use(servePrecompressed);
 app.use(express.static(PUBLIC_DIR));
 
 // ---------- Helper: load JSON file using streaming parser for large files ----------
@@ -116,23 +234,13 @@ app.get("/api/default-files", (req, res) => {
     });
   }
 
-  try {
-    const fileRaw = fs.readFileSync(filePath, "utf8");
-
-    const file = JSON.parse(fileRaw);
-
-    return res.json({
-      hasDefaults: true,
-      file
-    });
-  } catch (err) {
-    console.error("Error reading default JSON files:", err);
-    return res.status(500).json({
-      hasDefaults: false,
-      error: "Failed to read default JSON files",
-      details: err.message,
-    });
-  }
+  // queen.json itself is fetched from url, where the .br/.gz written by xml_to_json.py are sent as they are,
+  // instead of reading and parsing the whole file here on every request
+  return res.json({
+    hasDefaults: true,
+    hasFile,
+    url: `/${world_data_location}`,
+  });
 });
 
 // ---------- Utility functions ----------
@@ -156,6 +264,39 @@ function parseCoords(coordString) {
   return result;
 }
 
+// xml_to_json.py writes region coords as coord_runs, flat [x, y, length, ...] runs along x, and site coords
+// as a flat [x, y] array, those are walked directly. the "x,y|x,y" strings of older queen.json files
+// still go through parseCoords
+function forEachRegionCoord(region, fn) {
+  const runs = region.coord_runs;
+  if (!Array.isArray(runs)) {
+    forEachCoord(region.coords, fn);
+    return;
+  }
+  for (let i = 0; i < runs.length - 2; i += 3) {
+    for (let dx = 0; dx < runs[i + 2]; dx++) {
+      fn(runs[i] + dx, runs[i + 1]);
+    }
+  }
+}
+
+function forEachCoord(coords, fn) {
+  if (Array.isArray(coords)) {
+    for (let i = 0; i < coords.length - 1; i += 2) {
+      fn(coords[i], coords[i + 1]);
+    }
+    return;
+  }
+  parseCoords(coords).forEach(({ x, y }) => fn(x, y));
+}
+
+function firstCoord(coords) {
+  if (Array.isArray(coords)) {
+    return coords.length >= 2 ? { x: coords[0], y: coords[1] } : null;
+  }
+  return parseCoords(coords)[0] || null;
+}
+
 function shallowMerge(a, b) {
   return Object.assign({}, a || {}, b || {});
 }
@@ -188,8 +329,7 @@ function buildWorldData(world) {
   // 1) Regions -> create cells
   regions.forEach((r) => {
     if (!r) return;
-    const coords = parseCoords(r.coords);
-    coords.forEach(({ x, y }) => {
+    forEachRegionCoord(r, (x, y) => {
       const cell = getOrCreateCell(x, y);
       cell.region = r;
     });
@@ -198,8 +338,7 @@ function buildWorldData(world) {
   // 2) Underground regions -> attach to cells
   ugr.forEach((ug) => {
     if (!ug) return;
-    const coords = parseCoords(ug.coords);
-    coords.forEach(({ x, y }) => {
+    forEachRegionCoord(ug, (x, y) => {
       const cell = getOrCreateCell(x, y);
       cell.undergroundRegions.push(ug);
     });
@@ -208,10 +347,10 @@ function buildWorldData(world) {
   // 3) push sites to cell
   sites.forEach((s) => {
     if (!s || !s.coords) return;
-    const coords = parseCoords(s.coords);
-    if (!coords.length) return; // esben you js brained motherfucker thats the kind of boolean logic we like to see
+    const coord = firstCoord(s.coords);
+    if (!coord) return; // esben you js brained motherfucker thats the kind of boolean logic we like to see
     
-    const { x, y } = coords[0];
+    const { x, y } = coord;
     const cell = getOrCreateCell(x, y);
     cell.sites.push(s);
   });
@@ -231,22 +370,295 @@ function buildWorldData(world) {
     // Remove region coords
     if (cell.region) {
       delete cell.region.coords;
+      delete cell.region.coord_runs;
     }
 
     // Remove underground region coords
     cell.undergroundRegions.forEach((ug) => {
       delete ug.coords;
+      delete ug.coord_runs;
     });
   });
 
   return { cells };
 }
 
+// ---------- buildWorldData from the precomputed cell grid ----------
+// grid.cells holds [x, y, region_id, underground_region_ids, site_ids] sorted by x then y, the same cells
+// buildWorldData would make, so all that is left is swapping the ids for the objects
+function buildWorldDataFromGrid(world, grid) {
+  const byId = (records) => {
+    const map = new Map();
+    normalizeToArray(records).forEach((r) => {
+      if (!r) return;
+      delete r.coords;
+      delete r.coord_runs;
+      map.set(String(r.id), r);
+    });
+    return map;
+  };
+  const regions = byId(world?.regions);
+  const ugr = byId(world?.underground_regions);
+  const sites = byId(world?.sites);
+  const lookup = (map, ids) => ids.map((id) => map.get(String(id))).filter(Boolean);
+
+  const cells = grid.cells.map(([x, y, regionId, ugrIds, siteIds]) => ({
+    key: `${x},${y}`,
+    x,
+    y,
+    region: regionId === null ? null : regions.get(String(regionId)) || null,
+    undergroundRegions: lookup(ugr, ugrIds),
+    sites: lookup(sites, siteIds),
+  }));
+  return { cells };
+}
+
+// cells.json carries the name and record counts of the world it was made from (world_fingerprint in
+// xml_to_json.py), a grid that doesnt match belongs to another world
+function gridMatchesWorld(grid, world) {
+  const fingerprint = grid.world;
+  if (!fingerprint || fingerprint.name !== (world?.name ?? null)) return false;
+  return ["regions", "underground_regions", "sites", "historical_events"].every(
+    (key) => fingerprint[key] === normalizeToArray(world?.[key]).length
+  );
+}
+
+// ---------- Default worldData, built once and kept until queen.json or cells.json change ----------
+let defaultWorldData = null; // { key, promise, response }
+
+function fileVersion(filePath) {
+  const stat = statOrNull(filePath);
+  return stat ? `${stat.size}-${stat.mtimeMs}` : "none";
+}
+
+function loadDefaultWorldData() {
+  const worldPath = path.join(PUBLIC_DIR, world_data_location);
+  const cellsPath = path.join(PUBLIC_DIR, cells_data_location);
+  const key = `${fileVersion(worldPath)}|${fileVersion(cellsPath)}`;
+  if (defaultWorldData && defaultWorldData.key === key) {
+    return defaultWorldData.promise;
+  }
+
+  const promise = (async () => {
+    const file = await loadDefaultFiles();
+    if (statOrNull(cellsPath)) {
+      const grid = await loadJsonFileStreaming(cellsPath).catch(() => null);
+      if (grid && Array.isArray(grid.cells) && gridMatchesWorld(grid, file)) {
+        return buildWorldDataFromGrid(file, grid);
+      }
+    }
+    return buildWorldData(file);
+  })();
+  defaultWorldData = { key, promise };
+  // dont keep a failed load around
+  promise.catch(() => {
+    if (defaultWorldData && defaultWorldData.promise === promise) {
+      defaultWorldData = null;
+    }
+  });
+  return promise;
+}
+
+// the POST /api/world-data body for the default world, serialized and compressed once per worldData instead of
+// on every request. brotli at quality 9, 11 takes minutes on a big world
+const gzipAsync = promisify(zlib.gzip);
+const brotliAsync = promisify(zlib.brotliCompress);
+
+async function encodeWorldDataResponse(worldData) {
+  const body = Buffer.from(JSON.stringify({ worldData }), "utf8");
+  const [gzip, br] = await Promise.all([
+    gzipAsync(body, { level: 9 }),
+    brotliAsync(body, {
+      params: {
+        [zlib.constants.BROTLI_PARAM_QUALITY]: 9,
+        [zlib.constants.BROTLI_PARAM_SIZE_HINT]: body.length,
+      },
+    }),
+  ]);
+  return { br, gzip, identity: body };
+}
+
+function loadDefaultWorldDataResponse() {
+  const promise = loadDefaultWorldData();
+  const entry = defaultWorldData;
+  if (!entry.response) {
+    entry.response = promise.then(encodeWorldDataResponse);
+  }
+  return entry.response;
+}
+
+function sendEncodedResponse(req, res, encoded) {
+  const encoding = ["br", "gzip"].find((name) => acceptsEncoding(req, name)) || "identity";
+  const body = encoded[encoding];
+  res.setHeader("Vary", "Accept-Encoding");
+  res.setHeader("Content-Type", "application/json; charset=utf-8");
+  if (encoding !== "identity") res.setHeader("Content-Encoding", encoding);
+  res.setHeader("Content-Length", body.length);
+  res.end(body);
+}
+
+// ---------- Map tiles (xml_to_json.py --tiles) ----------
+// GET /api/tiles gives the tile index (tile size, world size, a summary per tile), with ?minX=&minY=&maxX=&maxY=
+// (in cells) only the tiles overlapping that box. GET /api/tiles/:tx/:ty gives one tile with its cells and the full
+// region / site objects on them
+const tiles_location = "big/tiles";
+let tileIndex = null; // { key, index }
+
+function loadTileIndex() {
+  const indexPath = path.join(PUBLIC_DIR, tiles_location, "index.json");
+  const key = fileVersion(indexPath);
+  if (key === "none") return null;
+  if (!tileIndex || tileIndex.key !== key) {
+    tileIndex = { key, index: JSON.parse(fs.readFileSync(indexPath, "utf8")) };
+  }
+  return tileIndex.index;
+}
+
+app.get("/api/tiles", (req, res) => {
+  try {
+    const index = loadTileIndex();
+    if (!index) {
+      return res.status(404).json({ error: "No map tiles, run xml_to_json.py with --tiles" });
+    }
+    const box = ["minX", "minY", "maxX", "maxY"].map((k) => parseInt(req.query[k], 10));
+    if (box.some(Number.isNaN)) {
+      return res.json(index);
+    }
+    const [minX, minY, maxX, maxY] = box;
+    const size = index.tile_size;
+    const tiles = index.tiles.filter(
+      (t) => t.tx * size <= maxX && (t.tx + 1) * size > minX && t.ty * size <= maxY && (t.ty + 1) * size > minY
+    );
+    res.json({ ...index, tiles });
+  } catch (err) {
+    console.error("Error reading the tile index:", err);
+    res.status(500).json({ error: "Failed to read the tile index", details: err.message });
+  }
+});
+
+app.get("/api/tiles/:tx/:ty", (req, res, next) => {
+  const { tx, ty } = req.params;
+  if (!/^\d+$/.test(tx) || !/^\d+$/.test(ty)) {
+    return res.status(400).json({ error: "Tile coordinates must be whole numbers" });
+  }
+  const tilePath = path.join(PUBLIC_DIR, tiles_location, `${tx}_${ty}.json`);
+  if (sendPrecompressed(req, res, tilePath, next)) return;
+  if (!fs.existsSync(tilePath)) {
+    return res.status(404).json({ error: `No tile ${tx},${ty}` });
+  }
+  res.sendFile(tilePath);
+});
+
+// ---------- Search (xml_to_json.py --search-index) ----------
+// GET /api/search?q=urist+mining&kind=hf&limit=50 -> hfs, sites, books and events whose text has every word of q.
+// search/tokens.json has the sorted tokens and the byte range of each posting list in search/postings.bin,
+// a posting list is sorted typed ids (id * kinds.length + kind) as LEB128 varint deltas
+const search_location = "big/search";
+let searchIndex = null; // { key, tokens: Map token -> position, offsets, counts, kinds, postings: Buffer }
+
+function loadSearchIndex() {
+  const tokensPath = path.join(PUBLIC_DIR, search_location, "tokens.json");
+  const postingsPath = path.join(PUBLIC_DIR, search_location, "postings.bin");
+  const key = `${fileVersion(tokensPath)}|${fileVersion(postingsPath)}`;
+  if (key.includes("none")) return null;
+  if (!searchIndex || searchIndex.key !== key) {
+    const data = JSON.parse(fs.readFileSync(tokensPath, "utf8"));
+    const tokens = new Map();
+    data.tokens.forEach((token, i) => tokens.set(token, i));
+    searchIndex = {
+      key,
+      tokens,
+      offsets: data.offsets,
+      counts: data.counts,
+      kinds: data.kinds,
+      postings: fs.readFileSync(postingsPath),
+    };
+  }
+  return searchIndex;
+}
+
+function decodePostings(index, position) {
+  const ids = new Array(index.counts[position]);
+  let previous = 0;
+  let n = 0;
+  let value = 0;
+  let shift = 0;
+  for (let i = index.offsets[position]; i < index.offsets[position + 1]; i++) {
+    const byte = index.postings[i];
+    value += (byte & 0x7f) * 2 ** shift; // not <<, ids can go past 31 bits
+    shift += 7;
+    if (byte < 0x80) {
+      previous += value;
+      ids[n++] = previous;
+      value = 0;
+      shift = 0;
+    }
+  }
+  return ids;
+}
+
+function intersectSorted(a, b) {
+  const result = [];
+  let i = 0;
+  let j = 0;
+  while (i < a.length && j < b.length) {
+    if (a[i] === b[j]) {
+      result.push(a[i]);
+      i++;
+      j++;
+    } else if (a[i] < b[j]) {
+      i++;
+    } else {
+      j++;
+    }
+  }
+  return result;
+}
+
+app.get("/api/search", (req, res) => {
+  try {
+    const index = loadSearchIndex();
+    if (!index) {
+      return res.status(404).json({ error: "No search index, run xml_to_json.py with --search-index" });
+    }
+    const words = String(req.query.q || "").toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [];
+    const limit = Math.min(parseInt(req.query.limit, 10) || 50, 1000);
+    const kind = req.query.kind ? index.kinds.indexOf(req.query.kind) : -1;
+    if (!words.length) {
+      return res.json({ q: req.query.q || "", total: 0, results: [] });
+    }
+
+    // rarest word first, so the intersection stays small
+    const positions = [...new Set(words)].map((w) => index.tokens.get(w));
+    let matches = [];
+    if (!positions.includes(undefined)) {
+      positions.sort((a, b) => index.counts[a] - index.counts[b]);
+      matches = decodePostings(index, positions[0]);
+      for (const position of positions.slice(1)) {
+        if (!matches.length) break;
+        matches = intersectSorted(matches, decodePostings(index, position));
+      }
+    }
+
+    const kinds = index.kinds.length;
+    if (kind >= 0) {
+      matches = matches.filter((typedId) => typedId % kinds === kind);
+    }
+    const results = matches.slice(0, limit).map((typedId) => ({
+      kind: index.kinds[typedId % kinds],
+      id: Math.floor(typedId / kinds),
+    }));
+    res.json({ q: req.query.q, total: matches.length, results });
+  } catch (err) {
+    console.error("Error searching:", err);
+    res.status(500).json({ error: "Search failed", details: err.message });
+  }
+});
+
 // ---------- NEW: GET / -> worldData from default files ----------
 app.get("/", async (req, res) => {
   try {
-    const file = await loadDefaultFiles();
-    const worldData = buildWorldData(file);
+    const worldData = await loadDefaultWorldData();
 
     const firstCellWithBooks = worldData.cells.find((cell) =>
       cell.sites?.some((site) =>
@@ -281,26 +693,12 @@ app.get("/", async (req, res) => {
 // ---------- Existing POST /api/world-data (uses default files or body) ----------
 app.post("/api/world-data", async (req, res) => {
   try {
-    let file;
-
     // If body has files, use them; otherwise use default files
     if (req.body && req.body.file) {
-      file = req.body.file;
-    } else {
-      // Use default files from /public directory
-      file = await loadDefaultFiles();
+      return res.json({ worldData: buildWorldData(req.body.file) });
     }
-
-    if (!file) {
-      return res.status(400).json({
-        error:
-          "JSON file must be provided. Either include it in the request body or place default files in the /public directory.",
-      });
-    }
-
-    const worldData = buildWorldData(file);
-
-    res.json({ worldData });
+    // Use default files from /public directory, built, serialized and compressed once and cached
+    sendEncodedResponse(req, res, await loadDefaultWorldDataResponse());
     // console.log("WORLD DATA (from request body)", worldData);
   } catch (err) {
     console.error(err);
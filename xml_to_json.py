@@ -1,8 +1,27 @@
-import xmltodict
+import xml.etree.ElementTree as ET
 import json
+from array import array
 import os
+import re
 import math
-import random 
+import zlib
+import sys
+import argparse
+import multiprocessing
+import hashlib
+import pickle
+import sqlite3
+import time
+import gc
+import gzip
+import shutil
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import brotli # optional, pip install brotli to also get .br files next to the output
+except ImportError:
+    brotli = None
         
 ### MAIN SCRIPT ### 
 
@@ -11,120 +30,655 @@ FILES_PATH = os.path.join(BASE_DIR, "files")
 JSON_PATH = os.path.join(FILES_PATH, "jsons")
 
 
-def process_structure(structure):
+# ---------- STREAMING INGEST ----------- #
+# the legends exports are way too big to load in one go (several GB on long histories), so we stream them
+# one record (<site>, <historical_figure>, <historical_event>, ...) at a time and only keep what queen.json needs
+
+def keep_all(record):
+    return record
+
+def keep_fields(*fields):
+    def project(record):
+        if not isinstance(record, dict):
+            return record
+        return {k: v for k, v in record.items() if k in fields}
+    return project
+
+# any event key that can hold an hf, site or written content id. these are the only keys the event
+# translation and the hf/site linking look at, everything else on an event is dropped
+EVENT_KEY_MARKERS = ('hfid', 'hf_id', 'site', 'wc', 'written_content')
+
+def keep_event_fields(event):
+    if not isinstance(event, dict):
+        return event
+    return {k: v for k, v in event.items() if k in ('id', 'type', 'year', 'seconds72') or any(m in k for m in EVENT_KEY_MARKERS)}
+
+# section name -> projection applied to each of its records. sections that arent listed are skipped entirely
+LEGENDS_SECTIONS = {
+    'regions': keep_all,
+    'underground_regions': keep_all,
+    'sites': keep_all,
+    'artifacts': keep_fields('id', 'item', 'holder_hfid', 'site_id', 'structure_local_id'),
+    'historical_figures': keep_all,
+    'historical_events': keep_event_fields,
+    'written_contents': keep_fields('id', 'title'),
+}
+def parse_coords(coords):
+    # "3,4|3,5|..." -> array('i', [3, 4, 3, 5, ...]), flat x,y pairs. parsed once here so nothing downstream
+    # (the web server mostly) has to pick the numbers out of the string again
+    if not isinstance(coords, str):
+        return coords
+    return array('i', [int(n) for n in coords.replace('|', ',').split(',') if n])
+
+def coord_runs(coords):
+    # flat x,y pairs -> flat (x, y, length) runs along x, sorted by y then x. regions are big blobs of cells,
+    # this is a lot shorter than listing every cell and still just an array walk to expand
+    cells = sorted((coords[i + 1], coords[i]) for i in range(0, len(coords) - 1, 2))
+    runs = array('i')
+    for y, x in cells:
+        if runs and runs[-2] == y and runs[-3] + runs[-1] == x:
+            runs[-1] += 1
+        elif not runs or runs[-2] != y or runs[-3] + runs[-1] < x:
+            runs.extend((x, y, 1))
+    return runs
+
+def expand_coord_runs(runs):
+    # the other way around, flat (x, y, length) runs -> flat x,y pairs
+    coords = array('i')
+    for i in range(0, len(runs) - 2, 3):
+        x, y, length = runs[i], runs[i + 1], runs[i + 2]
+        for dx in range(length):
+            coords.extend((x + dx, y))
+    return coords
+
+def keep_region_coords(region):
+    if not isinstance(region, dict):
+        return region
+    projected = {k: v for k, v in region.items() if k == 'id'}
+    if 'coords' in region:
+        projected['coord_runs'] = coord_runs(parse_coords(region['coords']))
+    return projected
+
+LEGENDS_PLUS_SECTIONS = {
+    'regions': keep_region_coords,
+    'underground_regions': keep_region_coords,
+    'sites': keep_fields('id', 'civ_id', 'cur_owner_id', 'structures'),
+}
+
+# --fields: which fields of the records that end up in the output are kept. the stages only need the ids, names,
+# links and structures, everything else is there for whoever reads queen.json. full keeps whole records like before,
+# web-minimal only what the web client shows, analysis drops the bulky relationship and intrigue blocks
+HF_WEB_FIELDS = ('id', 'name', 'race', 'caste', 'associated_type', 'sphere', 'hf_link',
+                 'site_link', 'entity_link') # the last two are needed to place hfs
+SITE_WEB_FIELDS = ('id', 'name', 'type', 'coords', 'rectangle', 'structures')
+FIELD_PROFILES = {
+    'full': {},
+    'web-minimal': {
+        'regions': keep_fields('id', 'name', 'type'),
+        'underground_regions': keep_fields('id', 'type', 'depth'),
+        'sites': keep_fields(*SITE_WEB_FIELDS),
+        'historical_figures': keep_fields(*HF_WEB_FIELDS),
+    },
+    'analysis': {
+        'sites': keep_fields(*SITE_WEB_FIELDS, 'site_properties'),
+        'historical_figures': keep_fields(*HF_WEB_FIELDS, 'appeared', 'birth_year', 'birth_seconds72', 'death_year',
+                                          'death_seconds72', 'hf_skill', 'entity_position_link', 'entity_former_position_link',
+                                          'holds_artifact', 'deity', 'force', 'goal', 'ent_pop_id', 'used_identity',
+                                          'current_identity', 'vague_relationship', 'interaction_knowledge', 'active_interaction'),
+    },
+}
+
+def legends_sections(fields='full'):
+    sections = dict(LEGENDS_SECTIONS)
+    sections.update(FIELD_PROFILES[fields])
+    return sections
+
+# df loves doubling up articles ("the the bob"), we clean them up once when the text comes in so every
+# name, title and event string built from them is already clean
+ARTICLE_FIXES = (("the the", "the"), ("the The", "the"), ("The the", "The"), ("The The", "The"))
+
+def dedupe_articles(text):
+    if 'he ' not in text:
+        return text
+    for old, new in ARTICLE_FIXES:
+        text = text.replace(old, new)
+    return text
+
+def element_to_dict(elem):
+    # same shape xmltodict gives us: leaf -> text (or None), repeated tags -> list
+    if len(elem) == 0:
+        text = elem.text.strip() if elem.text else None
+        return dedupe_articles(text) if text else None
+    record = {}
+    for child in elem:
+        value = element_to_dict(child)
+        if child.tag not in record:
+            record[child.tag] = value
+        elif isinstance(record[child.tag], list):
+            record[child.tag].append(value)
+        else:
+            record[child.tag] = [record[child.tag], value]
+    return record
+
+def open_legends(path, encoding):
+    # encoding=None hands expat the raw bytes and it decodes them itself using the <?xml encoding=...?> declaration,
+    # only the text we keep ever becomes a python str. legends.xml says CP437, a single byte codec expat can do that way
+    if encoding is None:
+        return open(path, 'rb')
+    return open(path, encoding=encoding, errors='ignore')
+
+def stream_legends(path, sections, encoding=None):
+    # returns {'name': ..., 'altname': ..., 'sites': [...], 'historical_figures': [...], ...}
+    world = {section: [] for section in sections}
+    parents = []
+    with open_legends(path, encoding) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            depth = len(parents)
+            if depth == 2:
+                # a single record like <site> inside <sites>
+                section = parents[1].tag
+                if section in sections:
+                    world[section].append(sections[section](element_to_dict(elem)))
+                del parents[1][-1] # drop it from the tree so memory stays flat
+            elif depth == 1:
+                # top level stuff, either a section we just finished or a plain field like <name>
+                if len(elem) == 0 and elem.text and elem.text.strip():
+                    world[elem.tag] = dedupe_articles(elem.text.strip())
+                del parents[0][-1]
+    return world
+
+
+# hf id (int) -> the hf object we placed in a site or structure. filled in while assigning hfs,
+# every hf lookup after that goes through here instead of walking all the sites and structures
+hf_index = {}
+
+def index_hf(historical_figure):
+    hf_index.setdefault(int(historical_figure['id']), historical_figure)
+
+def process_structure(structure, historical_figures_list):
     historical_figures = []
     if 'inhabitant' in structure:
         #check if its a list or array
         if isinstance(structure['inhabitant'], str):
-            inhabitant = json_legends_clean.get('historical_figures').get('historical_figure')[int(structure['inhabitant'])]
+            inhabitant = historical_figures_list[int(structure['inhabitant'])]
             historical_figures.append(inhabitant)
             inhabitant["assigned"] = True
+            index_hf(inhabitant)
         else:
             for figure in structure['inhabitant']:
-                inhabitant = json_legends_clean.get('historical_figures').get('historical_figure')[int(figure)]
+                inhabitant = historical_figures_list[int(figure)]
                 historical_figures.append(inhabitant)
                 inhabitant["assigned"] = True
+                index_hf(inhabitant)
     structure["historical_figures"] = historical_figures
     return structure
 
-def artifact_has_written_content(artifact, written_content_id):
-    if not 'item' in artifact:
-        return False
-    if 'writing_written_content_id' in artifact['item']:
-        return str(artifact['item']['writing_written_content_id']) == str(written_content_id)
-    if 'page_written_content_id' in artifact['item']:
-        return str(artifact['item']['page_written_content_id']) == str(written_content_id)
-    return False
+def index_artifacts_by_written_content(artifacts):
+    # written content id (int) -> first artifact holding it, either as a scroll (writing_) or a codex/quire (page_)
+    artifacts_by_wc = {}
+    for artifact in artifacts:
+        item = artifact.get('item')
+        if not isinstance(item, dict):
+            continue
+        if 'writing_written_content_id' in item:
+            wc_id = id_key(item['writing_written_content_id'])
+        elif 'page_written_content_id' in item:
+            wc_id = id_key(item['page_written_content_id'])
+        else:
+            continue
+        if wc_id is not None:
+            artifacts_by_wc.setdefault(wc_id, artifact)
+    return artifacts_by_wc
+
+def id_key(value):
+    # ids come out of the xml as strings, the lookup tables are keyed by int
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 def get_hf_by_id(hfid):
-    for site in queen_json['sites']:
-        if 'historical_figures' in site:
-            for hf in site['historical_figures']:
-                if(str(hf['id']) == str(hfid)):
-                    return hf
-        if 'structures' not in site:
-            continue
-        for structure in site['structures']:
-            if 'historical_figures' not in structure:
-                continue
-            for hf in structure['historical_figures']:
-                if(str(hf['id']) == str(hfid)):
-                    return hf
-                
+    if hfid is None:
+        return None
+    return hf_index.get(int(hfid))
+
 def try_assign_book_to_hf(hfid, book):
     holder = get_hf_by_id(hfid)
     if not holder:
-        return False # since we're searching in the nested folder structure this should exclude any hfs that arent in a site
+        return False # only placed hfs are in the index so this excludes any hfs that arent in a site
     if not 'books' in holder:
         holder["books"] = []
     holder["books"].append(book)
     return True
 
+# entity id (int) -> its sites in site order, once for the sites it currently owns and once for the sites
+# of its civ. built right after the legends_plus merge since thats where cur_owner_id and civ_id come from
+sites_by_owner = {}
+sites_by_civ = {}
+
+def index_sites_by_entity(sites):
+    sites_by_owner.clear()
+    sites_by_civ.clear()
+    for site in sites:
+        owner_id = id_key(site.get('cur_owner_id'))
+        if owner_id is not None:
+            sites_by_owner.setdefault(owner_id, []).append(site)
+        civ_id = id_key(site.get('civ_id'))
+        if civ_id is not None:
+            sites_by_civ.setdefault(civ_id, []).append(site)
+
+def find_sites_by_entity(entity_id):
+    # every site of an entity, the ones it owns first and then the ones of its civ
+    key = id_key(entity_id)
+    sites = list(sites_by_owner.get(key, []))
+    seen = {id(site) for site in sites}
+    for site in sites_by_civ.get(key, []):
+        if id(site) not in seen:
+            sites.append(site)
+    return sites
+
 def find_site_by_entity(entity_id):
-    for site in queen_json['sites']:
-        if 'cur_owner_id' not in site:
-            continue
-        if str(site['cur_owner_id']) == str(entity_id):
-            return site
-    for site in queen_json['sites']:
-        if 'civ_id' not in site:
-            continue
-        if str(site['civ_id']) == str(entity_id):
-            return site
+    # owned sites win over civ sites
+    key = id_key(entity_id)
+    for index in (sites_by_owner, sites_by_civ):
+        if key in index:
+            return index[key][0]
     return None
 
 
-# ---------- START CODE EXECUTION ----------- #
+# bc hf ids are dynamic based on event type we need to store them in a dict and iterate through them
+EVENTS_HF_ID = {
+    'competition': ['winner_hfid', 'competitor_hfid'],
+    'hf wounded': ['woundee_hfid', 'wounder_hfid'],
+    'add hf hf link': ['hfid', 'hfid_target'],
+    'hf convicted': ['convicted_hfid', 'fooled_hfid', 'framer_hfid'],
+    'remove hf hf link': ['hfid', 'hfid_target'],
+    'hf learns secret': ['student_hfid', 'teacher_hfid'],
+    'hf relationship denied': ['seeker_hfid', 'target_hfid'],
+    'attacked site': ['attacker_general_hfid', 'defender_general_hfid'],
+    'hf abducted': ['target_hfid', 'snatcher_hfid'],
+    'changed creature type': ['changee_hfid', 'changer_hfid'],
+    'hfs formed intrigue relationship': ['target_hfid', 'corruptor_hfid', 'lure_hfid'],
+    'failed intrigue corruption': ['target_hfid', 'corruptor_hfid', 'lure_hfid'],
+    'hfs formed reputation relationship': ['hfid1', 'hfid2'],
+    'entity overthrown': ['overthrown_hfid', 'pos_taker_hfid', 'instigator_hfid', 'conspirator_hfid'],
+    'failed frame attempt': ['target_hfid', 'fooled_hfid', 'framer_hfid', 'plotter_hfid'],
+    'entity persecuted': ['persecutor_hfid', 'expelled_hfid', 'property_confiscated_from_hfid'],
+    'field battle': ['attacker_general_hfid', 'defender_general_hfid'],
+    'hf revived': ['hfid', 'actor_hfid']
+}
+
+EVENT_CONNECTORS = {
+    'competition': ['desiring against', 'mirroring inversely', 'cathecting toward', 'deterritorializing with', 'sublimating through', 'projecting upon', 'becoming-other to', 'jouissance versus', 'folding away from', 'rhizomatically opposing'],
+    'hf wounded': ['inscribing upon', 'castrating through', 'marking the Real of', 'intensifying into', 'wounding the symbolic of', 'cutting flows of', 'traumatizing', 'piercing the imaginary of', 'rupturing', 'severing lines-of-flight from'],
+    'add hf hf link': ['desiring-machines with', 'suturing to', 'assemblaging with', 'transference toward', 'deterritorializing alongside', 'folding into', 'rhizome-connecting', 'mirroring', 'symbiosis with', 'cathexis toward'],
+    'hf convicted': ['foreclosing with', 'paranoiac alongside', 'triangulating between', 'trapped in symbolic of', 'scapegoating through', 'Oedipalizing via', 'caught in Name-of-Father with', 'projection between', 'abjecting through', 'shadow-meeting'],
+    'remove hf hf link': ['decathecting from', 'deterritorializing away', 'severing assemblage with', 'foreclosing', 'repressing away from', 'unfolding from', 'cutting body-without-organs from', 'abjecting', 'splitting from objet petit a of', 'death-drive from'],
+    'hf learns secret': ['initiated beneath', 'unconscious-transfer from', 'gnosis through', 'hermetic with', 'unveiling via', 'psychopomp guided by', 'decoded by', 'hierophant under', 'unconscious revealed by', 'mystery-transmission from'],
+    'hf relationship denied': ['foreclosed by', 'negating the desire of', 'impossible Real rejected by', 'lack affirmed by', 'castrated by refusal of', 'void encountered with', 'abjected by', 'Tower-struck by', 'death card turned by', 'jouissance denied by'],
+    'attacked site': ['war-machine versus', 'striated confronting', 'molar opposing', 'death-drive clashing', 'Thanatos engaging', 'aggressive-cathexis toward', 'Mars ascending against', 'Tower-moment with', 'smooth-space colliding', 'chariot reversed to'],
+    'hf abducted': ['captured by desiring-machine of', 'stolen into assemblage of', 'reterritorialized by', 'possessed by libidinal economy of', 'seized into Symbolic of', 'Devil-bound to', 'enchained by', 'consumed by body-without-organs of', 'incorporated into', 'subsumed by flows of'],
+    'changed creature type': ['becoming-animal through', 'metamorphosis via sorcery of', 'molecular-transformed by', 'transmuted by alchemy of', 'death-and-rebirth under', 'pharmakonic shift by', 'deterritorialized absolutely by', 'magician-worked by', 'threshold-crossed through', 'schizoid-flow altered by'],
+    'hfs formed intrigue relationship': ['libidinal conspiracy with', 'unconscious pact between', 'Moon-card weaving', 'shadow-alliance entwining', 'paranoid-machine linking', 'occult geometry binding', 'secret-society formed with', 'hermetic knot between', 'spectral-bond to', 'conspiratorial assemblage'],
+    'failed intrigue corruption': ['resisting libidinal capture by', 'foreclosing seduction of', 'refusing reterritorialization by', 'rejecting Devil-pact with', 'escaping desiring-production of', 'negating sublimation by', 'deterritorializing away from trap of', 'severing manipulation of', 'breaking enchantment of', 'line-of-flight from'],
+    'hfs formed reputation relationship': ['semiotically entangled with', 'signifier-chained to', 'imaginary-construct alongside', 'reputation-assemblage with', 'symbolic-network connected to', 'collective-unconscious linked', 'fame-rhizome touching', 'archetypal resonance with', 'judgment-card reflected by', 'renown-machine producing with'],
+    'entity overthrown': ['supplanted in Name-of-Father by', 'dethroned through death-drive of', 'castration enacted by', 'molar-structure collapsed by', 'Emperor-toppled by', 'sovereign-power seized by', 'Oedipal displacement via', 'smooth-space opened by', 'striated-order broken by', 'regime-change through'],
+    'failed frame attempt': ['projection-failure toward', 'paranoid-delusion targeting', 'failed-signification against', 'collapsed-narrative toward', 'Moon-reversed scheming', 'thwarted-semiotics against', 'unsuccessful-encoding of', 'shadow-projection failing on', 'symbolic-trap avoided by', 'misrecognition attempting'],
+    'entity persecuted': ['scapegoat-mechanism upon', 'abjection-process targeting', 'paranoid-aggression toward', 'expelled from body-without-organs by', 'purified through sacrifice of', 'Devil-projection onto', 'othering-drive against', 'violent-reterritorialization of', 'casting-out performed by', 'pharmakos-making by'],
+    'field battle': ['war-machine collision with', 'Thanatos-expression meeting', 'violent-assemblage engaging', 'death-drive manifesting against', 'Mars-conjunct opposing', 'striated-warfare with', 'aggressive-flows clashing', 'Tower-energy confronting', 'molar-conflict between', 'combat-intensity versus'],
+    'hf revived': ['resurrected through sorcery of', 'recalled from death-space by', 'reanimated via necromantic', 'Judgment-reversed through', 'death-and-rebirth cycle by', 'returned from Real by', 'spectral-recall via', 'undead-becoming through', 'life-flow restored by', 'boundary-crossed back through']
+}
+
+# dict events that involve sites
+SITE_WC_EVENTS = {
+    'hf destroyed site': ['attacker_hfid', 'site_id'],
+    'entity incorporated': ['leader_hfid', 'site_id'],
+    'hf attacked site': ['attacker_hfid', 'site_id'],
+    'hf preach': ['speaker_hfid', 'site_hfid'],
+    'hf confronted': ['hfid', 'site_id'],
+    'site dispute': ['site_id_1', 'site_id_2'],
+    'gamble': ['gambler_hfid', 'site_id'],
+    'created site': ['builder_hfid', 'site_id'],
+    'created structure': ['builder_hfid', 'site_id'],
+    'hf died': ['hfid', 'slayer_hfid', 'site_id'],
+    'change hf state': ['hfid', 'site_id'],
+    'created world construction': ['wcid', 'master_wcid', 'site_id1', 'site_id2'],
+    'hf recruited unit type for entity': ['hfid', 'site_id'],
+    'modified building': ['modifier_hfid', 'site_id'],
+    'building profile acquired': ['acquirer_hfid', 'site_id'],
+    'written content composed': ['hfid', 'site_id', 'wc_id'],
+    'change hf body state': ['hfid', 'site_id']
+}
+
+SITE_WC_CONNECTORS = {
+    'hf destroyed site': ['annihilating through death-drive of', 'demolishing smooth-space via', 'razing symbolic-order through', 'Tower-collapse enacted by', 'apocalyptic-flow channeled by', 'destructive-cathexis from', 'war-machine unleashed by', 'dissolving assemblage through', 'violent deterritorialization by', 'entropic manifestation of'],
+    'entity incorporated': ['absorbing into body-without-organs via', 'subsuming territory through', 'Oedipal-capture by', 'incorporated into Empire by', 'reterritorialized under sovereign', 'swallowed by molar-structure of', 'assimilated into Symbolic of', 'Emperor-card claimed by', 'annexed into assemblage by', 'integrated through power of'],
+    'hf attacked site': ['aggressing upon territory through', 'striking at striated-space via', 'war-machine targeting', 'Mars-energy directed by', 'violent-flow channeled by', 'aggressive-cathexis toward space from', 'attacking assemblage through', 'Tower-moment initiated by', 'invading smooth-space via', 'hostile-intensity from'],
+    'hf preach': ['proclaiming at sacred-site through', 'Word-transmission at', 'hierophant-speaking at', 'preaching logos from', 'prophetic-utterance at site by', 'evangelical-assemblage at', 'holy discourse at via', 'Hermit-wisdom shared at by', 'spiritual-flow emanating at from', 'sermon-intensity at through'],
+    'hf confronted': ['confronting authority at', 'challenging molar-structure at through', 'defying striated-order at via', 'opposing regime at by', 'resisting at site through', 'rebellious-cathexis at from', 'standing against power at via', 'strength-card manifesting at through', 'insurrection at by', 'contestation at from'],
+    'site dispute': ['territorialized conflict between', 'warring assemblages of', 'contesting smooth-spaces', 'rivalry-machine connecting', 'opposed flows between', 'dialectical tension between', 'competitive-cathexis linking', 'Two of Swords between', 'disputed boundary between', 'antagonistic territories'],
+    'gamble': ['chance-taking at by', 'Wheel-of-Fortune spinning at through', 'risk-assemblage at via', 'gambling-drive at from', 'fortune-seeking at by', 'aleatory-moment at through', 'betting libidinal-economy at via', 'probability-flux at from', 'wagering intensities at by', 'luck-testing at through'],
+    'created site': ['founding territorial-assemblage through', 'establishing striated-space via', 'building world-construction through', 'erecting structure by', 'manifesting place via', 'creative-production of space by', 'territorializing through', 'Magician-manifesting site via', 'architectural-desire of', 'spatial-genesis through'],
+    'created structure': ['constructing edifice at via', 'building architectural-assemblage at through', 'erecting monument at by', 'manifesting structure at via', 'creating spatial-machine at through', 'architectural-production at by', 'material-assemblage at via', 'Tower-building at through', 'structuring space at by', 'edifice-becoming at via'],
+    'hf died': ['death-event at involving', 'final-severance at through', 'Death-card manifest at via', 'life-extinguished at by', 'mortality-realized at through', 'thanatos-culmination at via', 'perishing at by', 'death-assemblage at linking', 'final-deterritorialization at through', 'cessation at via'],
+    'change hf state': ['transformation at of', 'state-shift at affecting', 'metamorphic-event at involving', 'Temperance-change at of', 'condition-altered at for', 'becoming-other at of', 'status-flux at affecting', 'ontological-shift at of', 'transformation-intensity at for', 'state-assemblage changing at'],
+    'created world construction': ['cosmic-construction linking', 'world-making assemblage connecting', 'architectural-rhizome between', 'construction-network linking', 'built-environment web connecting', 'spatial-matrix linking', 'World-card manifest linking', 'infrastructural-assemblage between', 'construction-flows connecting', 'built-topology linking'],
+    'hf recruited unit type for entity': ['military-assemblage at through', 'recruiting war-machine at via', 'gathering forces at by', 'conscription-event at through', 'soldier-production at by', 'martial-cathexis at via', 'army-building at through', 'militant-assemblage at from', 'recruiting-intensity at by', 'warrior-gathering at via'],
+    'modified building': ['altering structure at via', 'transforming edifice at through', 'modifying architectural-assemblage at by', 'reshaping built-space at via', 'renovation-event at through', 'structural-metamorphosis at by', 'rebuilding-assemblage at via', 'architectural-flux at from', 'structure-becoming at through', 'spatial-modification at by'],
+    'building profile acquired': ['acquiring architectural-knowledge at through', 'learning structural-form at via', 'mastering building-assemblage at by', 'obtaining construction-gnosis at through', 'architectural-initiation at via', 'building-wisdom acquired at by', 'structural-understanding at from', 'construction-knowledge at through', 'architectural-mastery at via', 'building-profile absorbed at by'],
+    'written content composed': ['text-production at linking', 'writing-assemblage at connecting', 'authored-work at via', 'literary-creation at by', 'textual-inscription at through', 'composed-content at linking', 'scribed-work at via', 'written-assemblage at from', 'document-genesis at by', 'text-manifesting at through'],
+    'change hf body state': ['corporeal-transformation at of', 'body-metamorphosis at affecting', 'physical-alteration at of', 'flesh-becoming at for', 'bodily-flux at involving', 'somatic-shift at of', 'embodied-change at affecting', 'body-assemblage altered at for', 'physical-state changed at of', 'corporeal-flux at involving']
+}
+
+
+class NameResolver:
+    """Names of hfs, sites and written contents by int id. built once per world and shared by every event."""
 
+    def __init__(self, historical_figures, sites, written_contents):
+        self.hf_names = {int(hf['id']): hf.get('name', 'Nameless One') for hf in historical_figures}
+        self.site_names = {int(site['id']): site.get('name', 'Nameless Place') for site in sites}
+        self.wc_names = {int(wc['id']): wc.get('title', 'Nameless Work') for wc in written_contents}
+
+    def hf_name(self, hfid, default):
+        return self.hf_names.get(id_key(hfid), default)
+
+    def site_name(self, site_id, default):
+        return self.site_names.get(id_key(site_id), default)
+
+    def wc_name(self, wc_id, default):
+        return self.wc_names.get(id_key(wc_id), default)
+
+
+# ---------- SEEDED RNG ----------- #
+# connector choice and the fallback book placement draw from an rng made from --seed and the id of the event or
+# book, so the same input and seed always give byte identical output, no matter the order or the process that
+# handles each event
+
+MASK_64 = (1 << 64) - 1
+
+class SeededRng:
+    """splitmix64 for one event or book. a lot cheaper to set up than a random.Random per event."""
+
+    def __init__(self, seed, entity_id):
+        self.state = ((seed << 32) ^ entity_id) & MASK_64
+
+    def next(self):
+        self.state = (self.state + 0x9E3779B97F4A7C15) & MASK_64
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+        return z ^ (z >> 31)
+
+    def choice(self, seq):
+        return seq[self.next() % len(seq)]
+
+    def random(self):
+        return (self.next() >> 11) / (1 << 53)
+
+def entity_rng(seed, entity_id):
+    key = id_key(entity_id)
+    if key is None:
+        # ids that arent numbers (book keys like "orphan3") still need to land on the same draws every run
+        key = zlib.crc32(str(entity_id).encode('utf-8'))
+    return SeededRng(seed, key)
+
+
+# ---------- EVENT FORMATTERS ----------- #
+# every event type gets compiled once into a formatter that already knows which keys to read, what kind of id
+# each one holds and which connectors go between them, so rendering an event is just lookups and appends.
+# to cover a new event type add it to the tables above or call register_event_type
+
+# kind -> (link prefix, NameResolver dict holding the names, fallback name for ids it doesnt know)
+FIELD_KINDS = {
+    'hf': ('historical_figure_id', 'hf_names', 'hf {}'),
+    'site': ('site_id', 'site_names', 'site {}'),
+    'wc': ('written_work_id', 'wc_names', 'text {}'),
+}
 
-# /!\ for the script to work, the XML files need to be on the files/ folder. /!\
-for entry in os.listdir(FILES_PATH):
-    full_path = os.path.join(FILES_PATH, entry)
-    if not os.path.isfile(full_path):
-        continue
-
-    if entry.endswith('legends.xml'):
-        print(f"loading in {entry} !!")
-        with open(full_path, encoding='cp437', errors='ignore') as f:
-            json_legends = xmltodict.parse(f.read())
-
-    elif entry.endswith('legends_plus.xml'):
-        print(f"loading in {entry} !!")
-        with open(full_path, encoding='UTF-8', errors='ignore') as f:
-            json_legends_plus = xmltodict.parse(f.read())
-
-    elif entry == "enhanced_books.json":
-        print(f"loading in {entry} !!")
-        with open(full_path, encoding='UTF-8') as f:
-            json_books = json.load(f)
-
-# this is gonna be our output json with all the s**t in it.
-# this approach is different from the old one. were not removing stuff from the old files were selectively putting the s**t we want into a new one.
-queen_json = {}
-
-json_legends_plus_clean = json_legends_plus.get('df_world')
-json_legends_clean = json_legends.get('df_world')
-
-queen_json["name"] = json_legends_plus_clean.get('name')
-queen_json["altname"] = json_legends_plus_clean.get('altname')
-queen_json["regions"] = json_legends_clean.get('regions').get('region')
-queen_json["underground_regions"] = json_legends_clean.get('underground_regions').get('underground_region')
-queen_json["sites"] = json_legends_clean.get('sites').get('site')
-
-# get coords from legends plus
-for region in queen_json['regions']:
-    region_plus = json_legends_plus_clean.get('regions').get('region')[int(region['id'])]
-    region['coords'] = region_plus['coords']
-for region in queen_json['underground_regions']:
-    region_plus = json_legends_plus_clean.get('underground_regions').get('underground_region')[int(region['id'])]
-    region['coords'] = region_plus['coords']
-
-# so we fill the site object with all the other s**t
-sites_plus_length = len(json_legends_plus_clean.get('sites').get('site'))
-for site in queen_json['sites']:
-    # so right now we're only assining HFs to structures that have them as an inhabitant which is s**tt
-    if(int(site['id']) < sites_plus_length):
-        site_plus = json_legends_plus_clean.get('sites').get('site')[int(site['id'])-1]
+def field_kind(key):
+    # detect id type by key name
+    if 'hfid' in key or 'hf_id' in key:
+        return 'hf'
+    if 'site_id' in key or 'site_hfid' in key or key.startswith('site_'):
+        return 'site'
+    if 'wc' in key or 'written_content' in key:
+        return 'wc'
+    return 'generic'
+
+class EventFormatter:
+    """One event type compiled down to (key, kind) fields plus its connectors.
+
+    hf_only formatters are the hf-hf events: every key is an hf, unknown hfs are "Nameless One" and multiple hfs
+    under one key are joined with 'and' plus a connector. the others mix hfs, sites and written contents.
+    """
+
+    def __init__(self, keys, connectors, hf_only=False):
+        self.hf_only = hf_only
+        self.fields = [(key, 'hf' if hf_only else field_kind(key)) for key in keys]
+        self.connectors = connectors
+        self.total_keys = len(keys)
+
+    def render(self, event, names, rng):
+        string = ""
+        counter = 0
+        for key, kind in self.fields:
+            value = event.get(key)
+            if value is None:
+                continue
+            if kind == 'generic':
+                # generic fallback, AI suggestion
+                string += f'{key}:{value}'
+            else:
+                prefix, names_attr, fallback = FIELD_KINDS[kind]
+                lookup = getattr(names, names_attr)
+                values = value if isinstance(value, list) else (value,)
+                last = len(values) - 1
+                for i, v in enumerate(values):
+                    name = lookup.get(id_key(v), "Nameless One" if self.hf_only else fallback.format(v))
+                    string += f'<a href="{prefix}/{v}">{name}</a>'
+                    if i < last:
+                        # we need the 'and' in case is a list for the str to make sense yk
+                        string += f' and {rng.choice(self.connectors)} ' if self.hf_only else ' and '
+            counter += 1
+            if counter < self.total_keys:
+                string += f' {rng.choice(self.connectors)} '
+        return string if self.hf_only else string.strip()
+
+EVENT_FORMATTERS = {}
+
+def register_event_type(event_type, keys, connectors=None, hf_only=False):
+    EVENT_FORMATTERS[event_type] = EventFormatter(keys, connectors or ['at', 'in', 'within'], hf_only)
+
+# hf-hf only events
+for event_type, keys in EVENTS_HF_ID.items():
+    register_event_type(event_type, keys, EVENT_CONNECTORS.get(event_type, []), hf_only=True)
+# hf + site/wc mixed events or only site/wc events
+for event_type, keys in SITE_WC_EVENTS.items():
+    if event_type not in EVENT_FORMATTERS:
+        register_event_type(event_type, keys, SITE_WC_CONNECTORS.get(event_type))
+
+# key -> (links an hf, links a site), the same handful of key names come back on every event
+LINK_KEYS = {}
+
+def link_key(key):
+    if key not in LINK_KEYS:
+        LINK_KEYS[key] = ('hfid' in key, 'site_id' in key)
+    return LINK_KEYS[key]
+
+
+class EventTranslator:
+    """Turns a historical event into its linked event string plus the hfs and sites it touches."""
+
+    def __init__(self, names, seed=0):
+        self.names = names
+        self.seed = seed
+
+    def translate(self, event):
+        return_value = {}
+        formatter = EVENT_FORMATTERS.get(event.get('type'))
+        if formatter:
+            string = formatter.render(event, self.names, entity_rng(self.seed, event.get('id')))
+            if string:
+                return_value['event_string'] = string
+
+        hf_links = []
+        site_links = []
+        for key, value in event.items():
+            links_hf, links_site = link_key(key)
+            if links_hf:
+                hf_links.append((key, value))
+            if links_site:
+                site_links.append((key, value))
+        return_value['hf_links'] = hf_links
+        return_value['site_links'] = site_links
+        return return_value
+
+
+# ---------- EVENT CHUNKS ----------- #
+# events are translated in fixed size chunks, either in this process or spread over a process pool.
+# every event gets its own seeded rng so the output is the same for any number of workers
+
+EVENT_CHUNK_SIZE = 5000
+
+def link_ids(links):
+    # (key, value) pairs from the translator -> flat list of ids, values can be a single id or a list of them
+    ids = []
+    for k, value in links:
+        if isinstance(value, list):
+            ids.extend(value)
+        else:
+            ids.append(value)
+    return ids
+
+def translate_event_chunk(names, events, seed):
+    # returns (event entries, [(event_id, hf_id)], [(event_id, site_id)], event times) in event order.
+    # event times are the (id, year, seconds72) of every event in the chunk, string or not, as int arrays
+    translator = EventTranslator(names, seed)
+    event_entries = []
+    hf_links = []
+    site_links = []
+    event_times = (array('i'), array('i'), array('i'))
+    for event in events:
+        event_data = translator.translate(event)
+        year = id_key(event.get('year'))
+        seconds72 = id_key(event.get('seconds72'))
+        if id_key(event.get('id')) is not None:
+            event_times[0].append(int(event['id']))
+            event_times[1].append(year if year is not None else -1)
+            event_times[2].append(seconds72 if seconds72 is not None else -1)
+        if 'event_string' in event_data:
+            event_entry = {}
+            event_entry['string'] = event_data['event_string']
+            event_entry['id'] = event['id']
+            event_entry['year'] = event.get('year')
+            if 'seconds72' in event:
+                event_entry['seconds72'] = event['seconds72']
+            event_entries.append(event_entry)
+        for hf_id in link_ids(event_data['hf_links']):
+            hf_links.append((event['id'], hf_id))
+        for site_id in link_ids(event_data['site_links']):
+            site_links.append((event['id'], site_id))
+    return event_entries, hf_links, site_links, event_times
+
+worker_names = None
+worker_seed = 0
+
+def init_event_worker(names, seed):
+    global worker_names, worker_seed
+    worker_names = names
+    worker_seed = seed
+
+def translate_event_chunk_in_worker(events):
+    return translate_event_chunk(worker_names, events, worker_seed)
+
+def event_chunks(events):
+    for chunk_start in range(0, len(events), EVENT_CHUNK_SIZE):
+        yield events[chunk_start:chunk_start + EVENT_CHUNK_SIZE]
+
+
+# ---------- PIPELINE STAGES ----------- #
+
+def find_world_files(files_path):
+    world_files = {'legends': None, 'legends_plus': None, 'books': None}
+    # /!\ for the script to work, the XML files need to be on the files/ folder. /!\
+    for entry in os.listdir(files_path):
+        full_path = os.path.join(files_path, entry)
+        if not os.path.isfile(full_path):
+            continue
+        if entry.endswith('legends.xml'):
+            world_files['legends'] = full_path
+        elif entry.endswith('legends_plus.xml'):
+            world_files['legends_plus'] = full_path
+        elif entry == "enhanced_books.json":
+            world_files['books'] = full_path
+    return world_files
+
+def load_legends(path, fields='full'):
+    print(f"loading in {os.path.basename(path)} !!")
+    return stream_legends(path, legends_sections(fields)) # declared as CP437, decoded by the parser
+
+def load_legends_plus(path):
+    print(f"loading in {os.path.basename(path)} !!")
+    return stream_legends(path, LEGENDS_PLUS_SECTIONS, 'UTF-8')
+
+def load_books(path):
+    print(f"loading in {os.path.basename(path)} !!")
+    with open(path, encoding='UTF-8') as f:
+        json_books = json.load(f)
+    for book in json_books['data'].values():
+        for key, value in book.items():
+            if isinstance(value, str):
+                book[key] = dedupe_articles(value)
+    return json_books
+
+END_OF_RECORDS = object()
+
+def join_by_id(records, plus_records):
+    # yields (record, its legends_plus record or None) matched on id. both exports list records in id order so
+    # this walks them side by side and only holds on to plus records that show up before the one were looking for,
+    # which keeps it flat on memory but still right when the order doesnt match. works on lists or generators
+    plus_records = iter(plus_records)
+    pending = {}
+    for record in records:
+        key = id_key(record.get('id'))
+        while key not in pending:
+            plus_record = next(plus_records, END_OF_RECORDS)
+            if plus_record is END_OF_RECORDS:
+                break
+            if isinstance(plus_record, dict):
+                pending.setdefault(id_key(plus_record.get('id')), plus_record)
+        yield record, pending.pop(key, None)
+
+def merge_world(legends, legends_plus):
+    # this is gonna be our output json with all the s**t in it.
+    # this approach is different from the old one. were not removing stuff from the old files were selectively putting the s**t we want into a new one.
+    queen_json = {}
+
+    queen_json["name"] = legends_plus.get('name')
+    queen_json["altname"] = legends_plus.get('altname')
+    queen_json["regions"] = legends['regions']
+    queen_json["underground_regions"] = legends['underground_regions']
+    queen_json["sites"] = legends['sites']
+
+    # get coords from legends plus
+    for region, region_plus in join_by_id(queen_json['regions'], legends_plus['regions']):
+        if region_plus is not None and 'coord_runs' in region_plus:
+            region['coord_runs'] = region_plus['coord_runs']
+    for region, region_plus in join_by_id(queen_json['underground_regions'], legends_plus['underground_regions']):
+        if region_plus is not None and 'coord_runs' in region_plus:
+            region['coord_runs'] = region_plus['coord_runs']
+
+    # so we fill the site object with all the other s**t
+    for site, site_plus in join_by_id(queen_json['sites'], legends_plus['sites']):
+        if 'coords' in site:
+            site['coords'] = parse_coords(site['coords'])
+        # so right now we're only assining HFs to structures that have them as an inhabitant which is s**tt
+        if site_plus is None:
+            continue
         if 'civ_id' in site_plus:
             site['civ_id'] = site_plus['civ_id']
         if 'cur_owner_id' in site_plus:
@@ -133,64 +687,69 @@ for site in queen_json['sites']:
             site["structures"] = []
             if isinstance(site_plus['structures']['structure'], list):
                 for structure in site_plus['structures']['structure']:
-                    site["structures"].append(process_structure(structure))
+                    site["structures"].append(process_structure(structure, legends['historical_figures']))
             else:
-                site["structures"].append(process_structure(site_plus['structures']['structure']))
-
-print("- total hf", len(json_legends_clean.get('historical_figures').get('historical_figure')))
-assigned_hf_1 = 0
-assigned_hf_2 = 0
-assigned_hf_3 = 0
-
-for historical_figure in json_legends_clean.get('historical_figures').get('historical_figure'):
-    if 'assigned' in historical_figure:
-        assigned_hf_1 += 1
-        continue
-    if 'site_link' in historical_figure:
-        site = queen_json.get('sites')[int(historical_figure['site_link']['site_id'])-1]
-        if not 'historical_figures' in site:
-            site["historical_figures"] = []
-        site["historical_figures"].append(historical_figure)
-        assigned_hf_2 += 1
-        continue
-    if 'entity_link' in historical_figure:
-        entity = None
-        if not isinstance(historical_figure['entity_link'], list): 
-            entity = historical_figure['entity_link']['entity_id']
-        else:
-            entities = list(filter(lambda e: e['link_type'] != 'enemy',  # should enemies be filtered idk
-            historical_figure['entity_link']))
-            if len(entities) > 0:
-                entity = historical_figure['entity_link'][0]['entity_id']
-        if not entity: continue
-        site = find_site_by_entity(entity)
-        if not site: continue
-        if not 'historical_figures' in site:
-            site["historical_figures"] = []
-        site["historical_figures"].append(historical_figure)
-        assigned_hf_3 += 1
-        continue
-
-print("- figures assigned by inhabitant: ", assigned_hf_1)
-print("- figures assigned by site-link: ", assigned_hf_2)
-print("- figures assigned by entity: ", assigned_hf_3)
-
-found_artifacts = 0
-found_holder_links = 0
-found_artifact_links = 0
-found_author_links = 0
-
-print("- total books: ", len(json_books['data']))
-
-for bookkey, book in json_books['data'].items():
-    assigned_book = False
-
-    # first try to locate by artifact because its the most true (ie the physical object of the book)
-    artifacts = list(filter(
-        lambda a: artifact_has_written_content(a, book['written_content_id']), 
-        json_legends_clean['artifacts']['artifact']))
-    if len(artifacts) != 0 and artifacts[0]:
-        artifact = artifacts[0]
+                site["structures"].append(process_structure(site_plus['structures']['structure'], legends['historical_figures']))
+
+    index_sites_by_entity(queen_json['sites'])
+    return queen_json
+
+def place_historical_figures(queen_json, historical_figures):
+    print("- total hf", len(historical_figures))
+    assigned_hf_1 = 0
+    assigned_hf_2 = 0
+    assigned_hf_3 = 0
+
+    for historical_figure in historical_figures:
+        if 'assigned' in historical_figure:
+            assigned_hf_1 += 1
+            continue
+        if 'site_link' in historical_figure:
+            site = queen_json.get('sites')[int(historical_figure['site_link']['site_id'])-1]
+            if not 'historical_figures' in site:
+                site["historical_figures"] = []
+            site["historical_figures"].append(historical_figure)
+            index_hf(historical_figure)
+            assigned_hf_2 += 1
+            continue
+        if 'entity_link' in historical_figure:
+            entity = None
+            if not isinstance(historical_figure['entity_link'], list): 
+                entity = historical_figure['entity_link']['entity_id']
+            else:
+                entities = list(filter(lambda e: e['link_type'] != 'enemy',  # should enemies be filtered idk
+                historical_figure['entity_link']))
+                if len(entities) > 0:
+                    entity = historical_figure['entity_link'][0]['entity_id']
+            if not entity: continue
+            site = find_site_by_entity(entity)
+            if not site: continue
+            if not 'historical_figures' in site:
+                site["historical_figures"] = []
+            site["historical_figures"].append(historical_figure)
+            index_hf(historical_figure)
+            assigned_hf_3 += 1
+            continue
+
+    print("- figures assigned by inhabitant: ", assigned_hf_1)
+    print("- figures assigned by site-link: ", assigned_hf_2)
+    print("- figures assigned by entity: ", assigned_hf_3)
+    return {'hfs': len(historical_figures), 'hfs_by_inhabitant': assigned_hf_1,
+            'hfs_by_site_link': assigned_hf_2, 'hfs_by_entity': assigned_hf_3}
+
+def place_books(queen_json, json_books, artifacts_by_wc, seed=0):
+    found_artifacts = 0
+    found_holder_links = 0
+    found_artifact_links = 0
+    found_author_links = 0
+
+    print("- total books: ", len(json_books['data']))
+
+    for bookkey, book in json_books['data'].items():
+        assigned_book = False
+
+        # first try to locate by artifact because its the most true (ie the physical object of the book)
+        artifact = artifacts_by_wc.get(id_key(book['written_content_id']))
         if artifact:
             found_artifacts += 1
             if 'holder_hfid' in artifact:
@@ -209,271 +768,928 @@ for bookkey, book in json_books['data'].items():
                     site["books"] = []
                 site["books"].append(book)
                 assigned_book = True
-    found_artifact_links += 1 if assigned_book else 0
-
-    # if that fails try to assign by author
-    if not assigned_book:
-        assigned_book = try_assign_book_to_hf(book['author_hfid'], book)
-        found_author_links += 1 if assigned_book else 0
-
-    # if that fails too assign it to a random site (home to the same civ/entity?)
-    if not assigned_book:
-        site = queen_json.get('sites')[math.floor(random.random() * len(queen_json.get('sites')))]
-        if not 'books' in site:
-            site["books"] = []
-        site["books"].append(book)
-        assigned_book = True
-    
-print("- total found artifacts ", found_artifacts)
-print("- artifact links ", found_artifact_links)
-print("- holder links", found_holder_links)
-print("- author links", found_author_links)
-
-def translate_event_to_string(event):
-    return_value = {}
-    
-    # bc hf ids are dynamic based on event type we need to store them in a dict and iterate through them
-    events_hf_id = {
-        'competition': ['winner_hfid', 'competitor_hfid'],
-        'hf wounded': ['woundee_hfid', 'wounder_hfid'],
-        'add hf hf link': ['hfid', 'hfid_target'],
-        'hf convicted': ['convicted_hfid', 'fooled_hfid', 'framer_hfid'],
-        'remove hf hf link': ['hfid', 'hfid_target'],
-        'hf learns secret': ['student_hfid', 'teacher_hfid'],
-        'hf relationship denied': ['seeker_hfid', 'target_hfid'],
-        'attacked site': ['attacker_general_hfid', 'defender_general_hfid'],
-        'hf abducted': ['target_hfid', 'snatcher_hfid'],
-        'changed creature type': ['changee_hfid', 'changer_hfid'],
-        'hfs formed intrigue relationship': ['target_hfid', 'corruptor_hfid', 'lure_hfid'],
-        'failed intrigue corruption': ['target_hfid', 'corruptor_hfid', 'lure_hfid'],
-        'hfs formed reputation relationship': ['hfid1', 'hfid2'],
-        'entity overthrown': ['overthrown_hfid', 'pos_taker_hfid', 'instigator_hfid', 'conspirator_hfid'],
-        'failed frame attempt': ['target_hfid', 'fooled_hfid', 'framer_hfid', 'plotter_hfid'],
-        'entity persecuted': ['persecutor_hfid', 'expelled_hfid', 'property_confiscated_from_hfid'],
-        'field battle': ['attacker_general_hfid', 'defender_general_hfid'],
-        'hf revived': ['hfid', 'actor_hfid']
-    }
-    
-    event_connectors = {
-        'competition': ['desiring against', 'mirroring inversely', 'cathecting toward', 'deterritorializing with', 'sublimating through', 'projecting upon', 'becoming-other to', 'jouissance versus', 'folding away from', 'rhizomatically opposing'],
-        'hf wounded': ['inscribing upon', 'castrating through', 'marking the Real of', 'intensifying into', 'wounding the symbolic of', 'cutting flows of', 'traumatizing', 'piercing the imaginary of', 'rupturing', 'severing lines-of-flight from'],
-        'add hf hf link': ['desiring-machines with', 'suturing to', 'assemblaging with', 'transference toward', 'deterritorializing alongside', 'folding into', 'rhizome-connecting', 'mirroring', 'symbiosis with', 'cathexis toward'],
-        'hf convicted': ['foreclosing with', 'paranoiac alongside', 'triangulating between', 'trapped in symbolic of', 'scapegoating through', 'Oedipalizing via', 'caught in Name-of-Father with', 'projection between', 'abjecting through', 'shadow-meeting'],
-        'remove hf hf link': ['decathecting from', 'deterritorializing away', 'severing assemblage with', 'foreclosing', 'repressing away from', 'unfolding from', 'cutting body-without-organs from', 'abjecting', 'splitting from objet petit a of', 'death-drive from'],
-        'hf learns secret': ['initiated beneath', 'unconscious-transfer from', 'gnosis through', 'hermetic with', 'unveiling via', 'psychopomp guided by', 'decoded by', 'hierophant under', 'unconscious revealed by', 'mystery-transmission from'],
-        'hf relationship denied': ['foreclosed by', 'negating the desire of', 'impossible Real rejected by', 'lack affirmed by', 'castrated by refusal of', 'void encountered with', 'abjected by', 'Tower-struck by', 'death card turned by', 'jouissance denied by'],
-        'attacked site': ['war-machine versus', 'striated confronting', 'molar opposing', 'death-drive clashing', 'Thanatos engaging', 'aggressive-cathexis toward', 'Mars ascending against', 'Tower-moment with', 'smooth-space colliding', 'chariot reversed to'],
-        'hf abducted': ['captured by desiring-machine of', 'stolen into assemblage of', 'reterritorialized by', 'possessed by libidinal economy of', 'seized into Symbolic of', 'Devil-bound to', 'enchained by', 'consumed by body-without-organs of', 'incorporated into', 'subsumed by flows of'],
-        'changed creature type': ['becoming-animal through', 'metamorphosis via sorcery of', 'molecular-transformed by', 'transmuted by alchemy of', 'death-and-rebirth under', 'pharmakonic shift by', 'deterritorialized absolutely by', 'magician-worked by', 'threshold-crossed through', 'schizoid-flow altered by'],
-        'hfs formed intrigue relationship': ['libidinal conspiracy with', 'unconscious pact between', 'Moon-card weaving', 'shadow-alliance entwining', 'paranoid-machine linking', 'occult geometry binding', 'secret-society formed with', 'hermetic knot between', 'spectral-bond to', 'conspiratorial assemblage'],
-        'failed intrigue corruption': ['resisting libidinal capture by', 'foreclosing seduction of', 'refusing reterritorialization by', 'rejecting Devil-pact with', 'escaping desiring-production of', 'negating sublimation by', 'deterritorializing away from trap of', 'severing manipulation of', 'breaking enchantment of', 'line-of-flight from'],
-        'hfs formed reputation relationship': ['semiotically entangled with', 'signifier-chained to', 'imaginary-construct alongside', 'reputation-assemblage with', 'symbolic-network connected to', 'collective-unconscious linked', 'fame-rhizome touching', 'archetypal resonance with', 'judgment-card reflected by', 'renown-machine producing with'],
-        'entity overthrown': ['supplanted in Name-of-Father by', 'dethroned through death-drive of', 'castration enacted by', 'molar-structure collapsed by', 'Emperor-toppled by', 'sovereign-power seized by', 'Oedipal displacement via', 'smooth-space opened by', 'striated-order broken by', 'regime-change through'],
-        'failed frame attempt': ['projection-failure toward', 'paranoid-delusion targeting', 'failed-signification against', 'collapsed-narrative toward', 'Moon-reversed scheming', 'thwarted-semiotics against', 'unsuccessful-encoding of', 'shadow-projection failing on', 'symbolic-trap avoided by', 'misrecognition attempting'],
-        'entity persecuted': ['scapegoat-mechanism upon', 'abjection-process targeting', 'paranoid-aggression toward', 'expelled from body-without-organs by', 'purified through sacrifice of', 'Devil-projection onto', 'othering-drive against', 'violent-reterritorialization of', 'casting-out performed by', 'pharmakos-making by'],
-        'field battle': ['war-machine collision with', 'Thanatos-expression meeting', 'violent-assemblage engaging', 'death-drive manifesting against', 'Mars-conjunct opposing', 'striated-warfare with', 'aggressive-flows clashing', 'Tower-energy confronting', 'molar-conflict between', 'combat-intensity versus'],
-        'hf revived': ['resurrected through sorcery of', 'recalled from death-space by', 'reanimated via necromantic', 'Judgment-reversed through', 'death-and-rebirth cycle by', 'returned from Real by', 'spectral-recall via', 'undead-becoming through', 'life-flow restored by', 'boundary-crossed back through']
-    }
-    
-    # dict events that involve sites
-    site_wc_events = {
-        'hf destroyed site': ['attacker_hfid', 'site_id'],
-        'entity incorporated': ['leader_hfid', 'site_id'],
-        'hf attacked site': ['attacker_hfid', 'site_id'],
-        'hf preach': ['speaker_hfid', 'site_hfid'],
-        'hf confronted': ['hfid', 'site_id'],
-        'site dispute': ['site_id_1', 'site_id_2'],
-        'gamble': ['gambler_hfid', 'site_id'],
-        'created site': ['builder_hfid', 'site_id'],
-        'created structure': ['builder_hfid', 'site_id'],
-        'hf died': ['hfid', 'slayer_hfid', 'site_id'],
-        'change hf state': ['hfid', 'site_id'],
-        'created world construction': ['wcid', 'master_wcid', 'site_id1', 'site_id2'],
-        'hf recruited unit type for entity': ['hfid', 'site_id'],
-        'modified building': ['modifier_hfid', 'site_id'],
-        'building profile acquired': ['acquirer_hfid', 'site_id'],
-        'written content composed': ['hfid', 'site_id', 'wc_id'],
-        'change hf body state': ['hfid', 'site_id']
+        found_artifact_links += 1 if assigned_book else 0
+
+        # if that fails try to assign by author
+        if not assigned_book:
+            assigned_book = try_assign_book_to_hf(book['author_hfid'], book)
+            found_author_links += 1 if assigned_book else 0
+
+        # if that fails too assign it to a random site (home to the same civ/entity?)
+        if not assigned_book:
+            rng = entity_rng(seed, book.get('written_content_id', bookkey))
+            site = queen_json.get('sites')[math.floor(rng.random() * len(queen_json.get('sites')))]
+            if not 'books' in site:
+                site["books"] = []
+            site["books"].append(book)
+            assigned_book = True
+
+    print("- total found artifacts ", found_artifacts)
+    print("- artifact links ", found_artifact_links)
+    print("- holder links", found_holder_links)
+    print("- author links", found_author_links)
+    return {'books': len(json_books['data']), 'books_with_artifact': found_artifacts, 'artifact_links': found_artifact_links,
+            'holder_links': found_holder_links, 'author_links': found_author_links}
+
+def translate_events(legends, workers=1, seed=0):
+    # -> list of per chunk (event entries, hf links, site links, event times), in event order
+    names = NameResolver(legends['historical_figures'], legends['sites'], legends['written_contents'])
+    events = legends['historical_events']
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=init_event_worker, initargs=(names, seed))
+        chunk_results = pool.imap(translate_event_chunk_in_worker, event_chunks(events))
+    else:
+        pool = None
+        chunk_results = (translate_event_chunk(names, chunk, seed) for chunk in event_chunks(events))
+
+    translated = []
+    event_counter = 0
+    try:
+        for chunk_result in chunk_results:
+            translated.append(chunk_result)
+            event_counter = min(event_counter + EVENT_CHUNK_SIZE, len(events))
+            print(event_counter, " historical events processed")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return translated
+
+def build_timeline(translated):
+    # every event (with or without a string) in (year, seconds72, id) order. year_offsets[i] is where years[i]
+    # starts in event_ids, so a year range is two binary searches over years. position maps an event id to its
+    # index in event_ids, only kept in memory
+    ids, years, seconds72 = array('i'), array('i'), array('i')
+    for chunk in translated:
+        chunk_ids, chunk_years, chunk_seconds72 = chunk[3]
+        ids.extend(chunk_ids)
+        years.extend(chunk_years)
+        seconds72.extend(chunk_seconds72)
+    order = sorted(range(len(ids)), key=lambda i: (years[i], seconds72[i], ids[i]))
+    timeline = {'event_ids': array('i', (ids[i] for i in order)), 'seconds72': array('i', (seconds72[i] for i in order)),
+                'years': array('i'), 'year_offsets': array('i')}
+    for offset, i in enumerate(order):
+        if not timeline['years'] or timeline['years'][-1] != years[i]:
+            timeline['years'].append(years[i])
+            timeline['year_offsets'].append(offset)
+    timeline['year_offsets'].append(len(order))
+    timeline['position'] = {event_id: position for position, event_id in enumerate(timeline['event_ids'])}
+    return timeline
+
+def link_events(queen_json, translated):
+    # every hf and site gets the ids of its events as an array('I') (4 bytes an id instead of a str object each),
+    # sorted by when they happened. returns the timeline that order comes from
+    queen_json["historical_events"] = []
+    linked = []
+    # start adding historical events to s**t
+    for event_entries, hf_links, site_links, event_times in translated:
+        queen_json["historical_events"].extend(event_entries)
+
+        for event_id, hf_id in hf_links:
+            hf = get_hf_by_id(hf_id)
+            if not hf: continue
+            if 'historical_events' not in hf:
+                hf['historical_events'] = array('I')
+                linked.append(hf)
+            hf['historical_events'].append(int(event_id))
+        for event_id, site_id in site_links:
+            site = queen_json['sites'][int(site_id)-1]
+            if 'historical_events' not in site:
+                site['historical_events'] = array('I')
+                linked.append(site)
+            site['historical_events'].append(int(event_id))
+
+    # event ids are mostly in time order already, so this is close to a linear pass for timsort
+    timeline = build_timeline(translated)
+    position = timeline['position']
+    for record in linked:
+        record['historical_events'] = array('I', sorted(record['historical_events'], key=position.__getitem__))
+    return timeline
+
+# ---------- TIMELINE OUTPUT ----------- #
+# --timeline: timeline.json with the sorted timeline from build_timeline plus, per hf and per site, the positions
+# of its events in event_ids. those are sorted, so "events of this site between year a and b" is year_offsets
+# for a and b and then two binary searches in the site's positions
+
+def write_timeline(queen_json, timeline, json_path, sharded):
+    position = timeline['position']
+    def positions(record):
+        return array('i', [position[event_id] for event_id in record['historical_events']])
+    hf_events = {}
+    for hf in hf_index.values():
+        if 'historical_events' in hf:
+            hf_events[hf['id']] = positions(hf)
+    site_events = {site['id']: positions(site) for site in queen_json['sites'] if 'historical_events' in site}
+    data = {key: timeline[key] for key in ('years', 'year_offsets', 'event_ids', 'seconds72')}
+    data.update({'hf_events': hf_events, 'site_events': site_events})
+    folder = output_folder(json_path, sharded)
+    os.makedirs(folder, exist_ok=True)
+    write_json_file(os.path.join(folder, 'timeline.json'), data, None)
+    return {'events': len(timeline['event_ids']), 'years': len(timeline['years'])}
+
+def remove_timeline(json_path, sharded):
+    path = os.path.join(output_folder(json_path, sharded), 'timeline.json')
+    if os.path.exists(path):
+        os.remove(path)
+    remove_precompressed(path)
+
+def json_default(value):
+    # the hf/site event back-references and the coords are int arrays, they go out as plain int lists
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def write_json_file(path, data, indent):
+    separators = (',', ':') if indent is None else None
+    with open(path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent, separators=separators, default=json_default)
+
+def write_queen_json(queen_json, json_path, indent=4):
+    if not os.path.exists(json_path):
+        os.mkdir(json_path)
+
+    # one pass straight to disk, json.dump encodes incrementally so the whole document never sits in memory as text.
+    # indent=None gives compact output which is a lot smaller
+    write_json_file(f'{json_path}/queen.json', queen_json, indent)
+
+# ---------- SHARDED OUTPUT ----------- #
+# instead of one big queen.json: a small manifest with the map level stuff, one file per site with everything
+# that lives in it, and the event strings in files covering a fixed id range. the client only fetches what it needs
+
+SITE_SUMMARY_KEYS = ('id', 'name', 'type', 'coords', 'rectangle', 'civ_id', 'cur_owner_id')
+EVENT_FILE_SPAN = 10000
+
+def write_sharded_world(queen_json, json_path, indent=4):
+    world_path = os.path.join(json_path, 'world')
+    os.makedirs(os.path.join(world_path, 'sites'), exist_ok=True)
+    os.makedirs(os.path.join(world_path, 'events'), exist_ok=True)
+
+    site_summaries = []
+    for site in queen_json['sites']:
+        site_file = f"sites/{site['id']}.json"
+        write_json_file(os.path.join(world_path, site_file), site, indent)
+        summary = {k: site[k] for k in SITE_SUMMARY_KEYS if k in site}
+        summary['file'] = site_file
+        site_summaries.append(summary)
+
+    events_by_span = {}
+    for event in queen_json['historical_events']:
+        span_start = int(event['id']) // EVENT_FILE_SPAN * EVENT_FILE_SPAN
+        events_by_span.setdefault(span_start, []).append(event)
+    event_files = []
+    for span_start in sorted(events_by_span):
+        span_end = span_start + EVENT_FILE_SPAN - 1
+        events_file = f"events/{span_start}-{span_end}.json"
+        write_json_file(os.path.join(world_path, events_file), events_by_span.pop(span_start), indent)
+        event_files.append({'first_id': span_start, 'last_id': span_end, 'file': events_file})
+
+    manifest = {
+        'name': queen_json['name'],
+        'altname': queen_json['altname'],
+        'regions': queen_json['regions'],
+        'underground_regions': queen_json['underground_regions'],
+        'sites': site_summaries,
+        'cells': 'cells.json',
+        'historical_events': event_files,
     }
-    
-    site_wc_connectors = {
-        'hf destroyed site': ['annihilating through death-drive of', 'demolishing smooth-space via', 'razing symbolic-order through', 'Tower-collapse enacted by', 'apocalyptic-flow channeled by', 'destructive-cathexis from', 'war-machine unleashed by', 'dissolving assemblage through', 'violent deterritorialization by', 'entropic manifestation of'],
-        'entity incorporated': ['absorbing into body-without-organs via', 'subsuming territory through', 'Oedipal-capture by', 'incorporated into Empire by', 'reterritorialized under sovereign', 'swallowed by molar-structure of', 'assimilated into Symbolic of', 'Emperor-card claimed by', 'annexed into assemblage by', 'integrated through power of'],
-        'hf attacked site': ['aggressing upon territory through', 'striking at striated-space via', 'war-machine targeting', 'Mars-energy directed by', 'violent-flow channeled by', 'aggressive-cathexis toward space from', 'attacking assemblage through', 'Tower-moment initiated by', 'invading smooth-space via', 'hostile-intensity from'],
-        'hf preach': ['proclaiming at sacred-site through', 'Word-transmission at', 'hierophant-speaking at', 'preaching logos from', 'prophetic-utterance at site by', 'evangelical-assemblage at', 'holy discourse at via', 'Hermit-wisdom shared at by', 'spiritual-flow emanating at from', 'sermon-intensity at through'],
-        'hf confronted': ['confronting authority at', 'challenging molar-structure at through', 'defying striated-order at via', 'opposing regime at by', 'resisting at site through', 'rebellious-cathexis at from', 'standing against power at via', 'strength-card manifesting at through', 'insurrection at by', 'contestation at from'],
-        'site dispute': ['territorialized conflict between', 'warring assemblages of', 'contesting smooth-spaces', 'rivalry-machine connecting', 'opposed flows between', 'dialectical tension between', 'competitive-cathexis linking', 'Two of Swords between', 'disputed boundary between', 'antagonistic territories'],
-        'gamble': ['chance-taking at by', 'Wheel-of-Fortune spinning at through', 'risk-assemblage at via', 'gambling-drive at from', 'fortune-seeking at by', 'aleatory-moment at through', 'betting libidinal-economy at via', 'probability-flux at from', 'wagering intensities at by', 'luck-testing at through'],
-        'created site': ['founding territorial-assemblage through', 'establishing striated-space via', 'building world-construction through', 'erecting structure by', 'manifesting place via', 'creative-production of space by', 'territorializing through', 'Magician-manifesting site via', 'architectural-desire of', 'spatial-genesis through'],
-        'created structure': ['constructing edifice at via', 'building architectural-assemblage at through', 'erecting monument at by', 'manifesting structure at via', 'creating spatial-machine at through', 'architectural-production at by', 'material-assemblage at via', 'Tower-building at through', 'structuring space at by', 'edifice-becoming at via'],
-        'hf died': ['death-event at involving', 'final-severance at through', 'Death-card manifest at via', 'life-extinguished at by', 'mortality-realized at through', 'thanatos-culmination at via', 'perishing at by', 'death-assemblage at linking', 'final-deterritorialization at through', 'cessation at via'],
-        'change hf state': ['transformation at of', 'state-shift at affecting', 'metamorphic-event at involving', 'Temperance-change at of', 'condition-altered at for', 'becoming-other at of', 'status-flux at affecting', 'ontological-shift at of', 'transformation-intensity at for', 'state-assemblage changing at'],
-        'created world construction': ['cosmic-construction linking', 'world-making assemblage connecting', 'architectural-rhizome between', 'construction-network linking', 'built-environment web connecting', 'spatial-matrix linking', 'World-card manifest linking', 'infrastructural-assemblage between', 'construction-flows connecting', 'built-topology linking'],
-        'hf recruited unit type for entity': ['military-assemblage at through', 'recruiting war-machine at via', 'gathering forces at by', 'conscription-event at through', 'soldier-production at by', 'martial-cathexis at via', 'army-building at through', 'militant-assemblage at from', 'recruiting-intensity at by', 'warrior-gathering at via'],
-        'modified building': ['altering structure at via', 'transforming edifice at through', 'modifying architectural-assemblage at by', 'reshaping built-space at via', 'renovation-event at through', 'structural-metamorphosis at by', 'rebuilding-assemblage at via', 'architectural-flux at from', 'structure-becoming at through', 'spatial-modification at by'],
-        'building profile acquired': ['acquiring architectural-knowledge at through', 'learning structural-form at via', 'mastering building-assemblage at by', 'obtaining construction-gnosis at through', 'architectural-initiation at via', 'building-wisdom acquired at by', 'structural-understanding at from', 'construction-knowledge at through', 'architectural-mastery at via', 'building-profile absorbed at by'],
-        'written content composed': ['text-production at linking', 'writing-assemblage at connecting', 'authored-work at via', 'literary-creation at by', 'textual-inscription at through', 'composed-content at linking', 'scribed-work at via', 'written-assemblage at from', 'document-genesis at by', 'text-manifesting at through'],
-        'change hf body state': ['corporeal-transformation at of', 'body-metamorphosis at affecting', 'physical-alteration at of', 'flesh-becoming at for', 'bodily-flux at involving', 'somatic-shift at of', 'embodied-change at affecting', 'body-assemblage altered at for', 'physical-state changed at of', 'corporeal-flux at involving']
-}
-    
-    return_value = {}
-    event_type = event.get('type')
-    
-    historical_figures_list = json_legends_clean.get('historical_figures').get('historical_figure')
-    hf_name_ids = {hf['id']: hf.get('name', 'Nameless One') for hf in historical_figures_list}
-    
-    sites_list = json_legends_clean.get('sites').get('site')
-    site_name_ids = {site['id']: site.get('name', 'Nameless Place') for site in sites_list}
-    
-    wc_list = json_legends_clean.get('written_contents', {}).get('written_content', [])
-    wc_name_ids = {wc['id']: wc.get('title', 'Nameless Work') for wc in wc_list} if isinstance(wc_list, list) else {}
-    
-    # hf-hf only events:
-    if event_type and event_type in events_hf_id:
-        hf_id_keys = events_hf_id[event_type]
-        connectors_event = event_connectors.get(event_type, [])
-        hf_id_values = [event.get(key) for key in hf_id_keys]
-        string = ""
-        counter = 0
-        total_hf_keys = len(hf_id_keys)
-        
-        for hf_key, hf_value in zip(hf_id_keys, hf_id_values):
-            if hf_value is None:
-                continue
-            if isinstance(hf_value, list):
-                # use the value position (i) as a counter to add connectors between multiple hfs
-                for i, v in enumerate(hf_value):
-                    hf_name = hf_name_ids.get(str(v), "Nameless One")
-                    string += f'<a href="historical_figure_id/{v}">{hf_name}</a>'
-                    if i < len(hf_value)-1:
-                        # we need the 'and' in case is a list for the str to make sense yk
-                        string += ' and ' + f'{random.choice(connectors_event)} '
-            else:
-                hf_name = hf_name_ids.get(str(hf_value), "Nameless One")
-                string += f'<a href="historical_figure_id/{hf_value}">{hf_name}</a>'
-            counter += 1
-            if counter < total_hf_keys:
-                string += f' {random.choice(connectors_event)} '
-        if string:
-            return_value['event_string'] = string
-    
-    # hf + site/wc mixed events or only site/wc events
-    elif event_type and event_type in site_wc_events:
-        keys_list = site_wc_events[event_type]
-        connectors = site_wc_connectors.get(event_type, ['at', 'in', 'within'])
-        string = ""
-        counter = 0
-        total_keys = len(keys_list)
-        
-        for key in keys_list:
-            value = event.get(key)
-            if value is None:
-                continue
-            
-            # detect id type by key name
-            if 'hfid' in key or 'hf_id' in key:
-                # if its a historical figure
-                if isinstance(value, list):
-                    for i, v in enumerate(value):
-                        hf_name = hf_name_ids.get(str(v), f"hf {v}")
-                        string += f'<a href="historical_figure_id/{v}">{hf_name}</a>'
-                        if i < len(value)-1:
-                            string += ' and '
-                else:
-                    hf_name = hf_name_ids.get(str(value), f"hf {value}")
-                    string += f'<a href="historical_figure_id/{value}">{hf_name}</a>'
-            
-            elif 'site_id' in key or 'site_hfid' in key or key.startswith('site_'):
-                # site
-                if isinstance(value, list):
-                    for i, v in enumerate(value):
-                        site_name = site_name_ids.get(str(v), f"site {v}")
-                        string += f'<a href="site_id/{v}">{site_name}</a>'
-                        if i < len(value)-1:
-                            string += ' and '
-                else:
-                    site_name = site_name_ids.get(str(value), f"site {value}")
-                    string += f'<a href="site_id/{value}">{site_name}</a>'
-            
-            elif 'wc' in key or 'written_content' in key:
-                #  written content / book
-                if isinstance(value, list):
-                    for i, v in enumerate(value):
-                        wc_title = wc_name_ids.get(str(v), f"text {v}")
-                        string += f'<a href="written_work_id/{v}">{wc_title}</a>'
-                        if i < len(value)-1:
-                            string += ' and '
-                else:
-                    wc_title = wc_name_ids.get(str(value), f"text {value}")
-                    string += f'<a href="written_work_id/{value}">{wc_title}</a>'
-            
-            else:
-                # generic fallback, AI suggestion
-                string += f'{key}:{value}'
-            
-            counter += 1
-            if counter < total_keys:
-                string += f' {random.choice(connectors)} '
-        
-        if string:
-            return_value['event_string'] = string.strip()
-    
-    if 'hf_links' not in return_value:
-        return_value['hf_links'] = list(filter(lambda p: 'hfid' in p[0], event.items()))
-    if 'site_links' not in return_value:
-        return_value['site_links'] = list(filter(lambda p: 'site_id' in p[0], event.items()))
-    
-    return return_value
-
-event_counter = 0
-queen_json["historical_events"] = []
-# start adding historical events to s**t
-for event in json_legends_clean.get('historical_events').get('historical_event'):
-    if event_counter%1000 == 0:
-        print(event_counter, " historical events processed")
-    event_counter += 1
-    event_data = translate_event_to_string(event)
-    
-    if 'event_string' in event_data:
-        event_entry = {}
-        event_entry['string'] = event_data['event_string']
-        event_entry['id'] = event['id']
-        queen_json["historical_events"].append(event_entry)
-
-    for k, hf_id in event_data['hf_links']:
-        if isinstance(hf_id, list):
-            for id in hf_id:
-                hf = get_hf_by_id(id)
-                if not hf: continue
-                if 'historical_events' not in hf:
-                    hf['historical_events'] = []
-                hf['historical_events'].append(event['id'])
+    write_json_file(os.path.join(world_path, 'manifest.json'), manifest, indent)
+
+# ---------- CELL GRID ----------- #
+# the map cells the web server used to build from the coords on every request: one entry per world tile with the
+# region, underground regions and sites on it, sorted by x then y. the server looks the ids up in queen.json
+# (or the manifest) and never has to walk the coords itself. always written compact, nobody reads it by hand
+
+def site_cell(site):
+    coords = site.get('coords')
+    if isinstance(coords, str):
+        coords = parse_coords(coords)
+    if not coords or len(coords) < 2:
+        return None
+    return coords[0], coords[1]
+
+def region_cells(region):
+    coords = expand_coord_runs(region['coord_runs']) if 'coord_runs' in region else parse_coords(region.get('coords'))
+    for i in range(0, len(coords or ()) - 1, 2):
+        yield coords[i], coords[i + 1]
+
+WORLD_COUNTED_KEYS = ('regions', 'underground_regions', 'sites', 'historical_events')
+
+def world_fingerprint(queen_json):
+    # lets the server tell if a cells.json goes with the queen.json next to it, file times dont survive copying
+    fingerprint = {'name': queen_json.get('name')}
+    fingerprint.update((key, len(queen_json.get(key, []))) for key in WORLD_COUNTED_KEYS)
+    return fingerprint
+
+def build_cell_grid(queen_json):
+    # same rules as buildWorldData in server.js: a later region wins a tile, underground regions and sites
+    # (on the first tile of their coords) pile up in file order
+    cells = {}
+    def cell(x, y):
+        if (x, y) not in cells:
+            cells[(x, y)] = [x, y, None, [], []]
+        return cells[(x, y)]
+    for region in queen_json['regions']:
+        for x, y in region_cells(region):
+            cell(x, y)[2] = id_key(region['id'])
+    for region in queen_json['underground_regions']:
+        for x, y in region_cells(region):
+            cell(x, y)[3].append(id_key(region['id']))
+    for site in queen_json['sites']:
+        tile = site_cell(site)
+        if tile is not None:
+            cell(*tile)[4].append(id_key(site['id']))
+    width = max((x for x, y in cells), default=-1) + 1
+    height = max((y for x, y in cells), default=-1) + 1
+    return {'world': world_fingerprint(queen_json), 'width': width, 'height': height,
+            'fields': ['x', 'y', 'region_id', 'underground_region_ids', 'site_ids'], 'cells': [cells[key] for key in sorted(cells)]}
+
+def output_folder(json_path, sharded):
+    return os.path.join(json_path, 'world') if sharded else json_path
+
+def write_cell_grid(grid, json_path, sharded):
+    folder = output_folder(json_path, sharded)
+    os.makedirs(folder, exist_ok=True)
+    write_json_file(os.path.join(folder, 'cells.json'), grid, None)
+    return {'cells': len(grid['cells'])}
+
+# ---------- MAP TILES ----------- #
+# --tiles: the cell grid cut into TILE_SIZE x TILE_SIZE chunks, so a viewer can fetch only what is on screen.
+# tiles/index.json has a small summary of every tile for the zoomed out map (main region, site counts),
+# tiles/<tx>_<ty>.json has its cells plus the full region, underground region and site objects on them
+
+TILE_SIZE = 16
+
+def tile_summary(tile_x, tile_y, cells, regions_by_id, sites_by_id):
+    region_cells = {}
+    site_types = {}
+    for x, y, region_id, underground_region_ids, site_ids in cells:
+        if region_id is not None:
+            region_cells[region_id] = region_cells.get(region_id, 0) + 1
+        for site_id in site_ids:
+            site_type = sites_by_id[site_id].get('type')
+            site_types[site_type] = site_types.get(site_type, 0) + 1
+    main_region = max(region_cells, key=region_cells.get) if region_cells else None
+    return {'tx': tile_x, 'ty': tile_y, 'file': f'{tile_x}_{tile_y}.json', 'cells': len(cells),
+            'main_region_id': main_region,
+            'main_region_type': regions_by_id[main_region].get('type') if main_region is not None else None,
+            'sites': sum(site_types.values()), 'site_types': site_types}
+
+def write_tiles(queen_json, grid, json_path, sharded, tile_size=TILE_SIZE):
+    tiles_path = os.path.join(output_folder(json_path, sharded), 'tiles')
+    if os.path.exists(tiles_path):
+        shutil.rmtree(tiles_path) # tiles of an older world or another tile size
+    os.makedirs(tiles_path)
+
+    def records_by_id(records):
+        # a copy without the coords, the tile cells already say where everything is
+        return {id_key(record['id']): {k: v for k, v in record.items() if k not in ('coords', 'coord_runs')}
+                for record in records}
+    regions_by_id = records_by_id(queen_json['regions'])
+    underground_regions_by_id = records_by_id(queen_json['underground_regions'])
+    sites_by_id = records_by_id(queen_json['sites'])
+
+    cells_by_tile = {}
+    for cell in grid['cells']:
+        cells_by_tile.setdefault((cell[0] // tile_size, cell[1] // tile_size), []).append(cell)
+
+    summaries = []
+    for (tile_x, tile_y), cells in sorted(cells_by_tile.items()):
+        region_ids = sorted({cell[2] for cell in cells if cell[2] is not None})
+        underground_region_ids = sorted({ug for cell in cells for ug in cell[3]})
+        site_ids = [site_id for cell in cells for site_id in cell[4]]
+        tile = {
+            'tx': tile_x, 'ty': tile_y, 'x': tile_x * tile_size, 'y': tile_y * tile_size, 'size': tile_size,
+            'fields': grid['fields'],
+            'cells': cells,
+            'regions': [regions_by_id[i] for i in region_ids],
+            'underground_regions': [underground_regions_by_id[i] for i in underground_region_ids],
+            'sites': [sites_by_id[i] for i in site_ids],
+        }
+        summary = tile_summary(tile_x, tile_y, cells, regions_by_id, sites_by_id)
+        write_json_file(os.path.join(tiles_path, summary['file']), tile, None)
+        summaries.append(summary)
+
+    index = {'tile_size': tile_size, 'width': grid['width'], 'height': grid['height'],
+             'tiles_x': -(-grid['width'] // tile_size), 'tiles_y': -(-grid['height'] // tile_size), 'tiles': summaries}
+    write_json_file(os.path.join(tiles_path, 'index.json'), index, None)
+    return {'tiles': len(summaries)}
+
+def remove_tiles(json_path, sharded):
+    tiles_path = os.path.join(output_folder(json_path, sharded), 'tiles')
+    if os.path.exists(tiles_path):
+        shutil.rmtree(tiles_path)
+
+# ---------- SEARCH INDEX ----------- #
+# --search-index: token -> every hf, site, book and event whose text has it, so a search doesnt have to scan
+# queen.json. search/tokens.json has the sorted tokens and where each posting list starts in search/postings.bin.
+# a posting list is the sorted typed ids (id * 4 + kind) of its documents, stored as deltas in LEB128 varints,
+# which mostly makes them a byte per posting
+
+SEARCH_KINDS = ('hf', 'site', 'book', 'event') # typed id = id * len(SEARCH_KINDS) + index in here
+TOKEN_PATTERN = re.compile(r"\w+")
+TAG_PATTERN = re.compile(r"<[^>]*>")
+
+def search_tokens(text):
+    if not text:
+        return ()
+    return set(TOKEN_PATTERN.findall(TAG_PATTERN.sub(' ', text).lower()))
+
+def search_documents(queen_json):
+    # (kind, id, text) for everything searchable. an hf or book placed in more than one spot is only listed once
+    seen = set()
+    def once(record):
+        if id(record) in seen:
+            return False
+        seen.add(id(record))
+        return True
+    def book_documents(books):
+        for book in books:
+            if once(book):
+                text = ' '.join(t for t in (book.get('title'), book.get('text_content')) if isinstance(t, str))
+                yield 'book', id_key(book.get('written_content_id')), text
+    def hf_documents(hfs):
+        for hf in hfs:
+            if once(hf):
+                yield 'hf', id_key(hf['id']), hf.get('name')
+                yield from book_documents(hf.get('books', []))
+
+    for site in queen_json['sites']:
+        yield 'site', id_key(site['id']), site.get('name')
+        for structure in site.get('structures', []):
+            yield from hf_documents(structure.get('historical_figures', []))
+            yield from book_documents(structure.get('books', []))
+        yield from hf_documents(site.get('historical_figures', []))
+        yield from book_documents(site.get('books', []))
+    for event in queen_json['historical_events']:
+        yield 'event', id_key(event['id']), event.get('string')
+
+def build_search_index(queen_json):
+    postings = {}
+    kind_count = len(SEARCH_KINDS)
+    for kind, doc_id, text in search_documents(queen_json):
+        if doc_id is None or doc_id < 0:
             continue
+        typed_id = doc_id * kind_count + SEARCH_KINDS.index(kind)
+        for token in search_tokens(text):
+            if token not in postings:
+                postings[token] = array('I')
+            postings[token].append(typed_id)
+    return postings
+
+def encode_postings(typed_ids):
+    # -> (varint bytes, number of postings)
+    typed_ids = sorted(set(typed_ids))
+    out = bytearray()
+    previous = 0
+    for typed_id in typed_ids:
+        delta = typed_id - previous
+        previous = typed_id
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return out, len(typed_ids)
+
+def write_search_index(queen_json, json_path, sharded):
+    search_path = os.path.join(output_folder(json_path, sharded), 'search')
+    os.makedirs(search_path, exist_ok=True)
+    postings = build_search_index(queen_json)
+    tokens = sorted(postings)
+    offsets = [0]
+    counts = []
+    with open(os.path.join(search_path, 'postings.bin'), 'wb', buffering=1 << 20) as f:
+        for token in tokens:
+            encoded, count = encode_postings(postings.pop(token))
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            counts.append(count)
+    write_json_file(os.path.join(search_path, 'tokens.json'),
+                    {'kinds': SEARCH_KINDS, 'tokens': tokens, 'offsets': offsets, 'counts': counts}, None)
+    return {'tokens': len(tokens), 'postings': sum(counts), 'postings_mb': round(offsets[-1] / (1024 * 1024), 1)}
+
+def remove_search_index(json_path, sharded):
+    search_path = os.path.join(output_folder(json_path, sharded), 'search')
+    if os.path.exists(search_path):
+        shutil.rmtree(search_path)
+
+# ---------- PRECOMPRESSED OUTPUT ----------- #
+# .gz (and .br when the brotli module is there) copies of every output json at max compression, so the web server
+# can send them as they are with a Content-Encoding instead of compressing queen.json on every request
+
+PRECOMPRESSED_EXTENSIONS = ('.gz', '.br')
+PRECOMPRESSED_SUMS = '.sha256'
+
+def output_json_files(json_path, sharded):
+    # walks the whole folder when sharded, only the files of this world otherwise (jsons/ holds the cache too)
+    folders = [os.path.join(json_path, 'world')] if sharded else [os.path.join(json_path, 'tiles'), os.path.join(json_path, 'search')]
+    paths = [] if sharded else [path for path in (os.path.join(json_path, name) for name in ('queen.json', 'cells.json', 'timeline.json'))
+                                if os.path.exists(path)]
+    for top in folders:
+        paths.extend(os.path.join(folder, entry) for folder, _, entries in os.walk(top)
+                     for entry in sorted(entries) if entry.endswith('.json'))
+    return paths
+
+def precompress_file(path):
+    # streams from the file on disk, the json never sits in memory as one string
+    # no filename and mtime 0 in the gzip header so the same json always gives the same .gz
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source, open(path + '.gz.tmp', 'wb') as raw, \
+            gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as target:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+            target.write(block)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    extensions = ['.gz']
+    if brotli is None:
+        # an old .br would be served with the new .gz, get rid of it
+        if os.path.exists(path + '.br'):
+            os.remove(path + '.br')
+    else:
+        compressor = brotli.Compressor(quality=11, lgwin=24)
+        with open(path, 'rb') as source, open(path + '.br.tmp', 'wb') as target:
+            for block in iter(lambda: source.read(1 << 20), b''):
+                target.write(compressor.process(block))
+            target.write(compressor.finish())
+        os.replace(path + '.br.tmp', path + '.br')
+        extensions.append('.br')
+    write_precompressed_sums(path, digest.hexdigest(), extensions)
+
+def write_precompressed_sums(path, json_digest, extensions):
+    # <file>.json.sha256 in sha256sum format: the json and the variants made from it. the server only sends a
+    # variant whose sums match the files next to it, file times dont survive copying so they cant tell
+    name = os.path.basename(path)
+    lines = [f"{json_digest}  {name}\n"]
+    lines.extend(f"{file_digest(path + extension)}  {name}{extension}\n" for extension in extensions)
+    with open(path + PRECOMPRESSED_SUMS + '.tmp', 'w', encoding='utf-8', newline='\n') as f:
+        f.writelines(lines)
+    os.replace(path + PRECOMPRESSED_SUMS + '.tmp', path + PRECOMPRESSED_SUMS)
+
+def remove_precompressed(path):
+    for extension in PRECOMPRESSED_EXTENSIONS + (PRECOMPRESSED_SUMS,):
+        if os.path.exists(path + extension):
+            os.remove(path + extension)
+
+def precompress_output(json_path, sharded):
+    paths = output_json_files(json_path, sharded)
+    for path in paths:
+        precompress_file(path)
+    return {'files': len(paths), 'brotli': brotli is not None}
+
+# ---------- SQLITE OUTPUT ----------- #
+# the same world as queen.json but as indexed tables, so "all events of this hf" or "books in this site" is a query
+# instead of loading the whole nested tree
+
+SQLITE_SCHEMA = """
+CREATE TABLE regions (id INTEGER PRIMARY KEY, name TEXT, type TEXT, coords TEXT);
+CREATE TABLE underground_regions (id INTEGER PRIMARY KEY, type TEXT, depth INTEGER, coords TEXT);
+CREATE TABLE sites (id INTEGER PRIMARY KEY, name TEXT, type TEXT, coords TEXT, rectangle TEXT, civ_id INTEGER, cur_owner_id INTEGER);
+CREATE TABLE structures (site_id INTEGER, local_id INTEGER, type TEXT, name TEXT, PRIMARY KEY (site_id, local_id));
+CREATE TABLE historical_figures (id INTEGER PRIMARY KEY, name TEXT, race TEXT, site_id INTEGER, structure_id INTEGER, data TEXT);
+CREATE TABLE books (written_content_id INTEGER, title TEXT, author_hfid INTEGER, text_content TEXT, site_id INTEGER, structure_id INTEGER, holder_hfid INTEGER);
+CREATE TABLE historical_events (id INTEGER PRIMARY KEY, year INTEGER, seconds72 INTEGER, string TEXT);
+CREATE TABLE hf_events (hfid INTEGER, event_id INTEGER);
+CREATE TABLE site_events (site_id INTEGER, event_id INTEGER);
+"""
+
+# created after the bulk insert, its a lot faster than keeping them up to date row by row
+SQLITE_INDEXES = """
+CREATE INDEX structures_site_id ON structures (site_id);
+CREATE INDEX historical_figures_site_id ON historical_figures (site_id);
+CREATE INDEX books_written_content_id ON books (written_content_id);
+CREATE INDEX books_site_id ON books (site_id);
+CREATE INDEX books_holder_hfid ON books (holder_hfid);
+CREATE INDEX books_author_hfid ON books (author_hfid);
+CREATE INDEX historical_events_year ON historical_events (year, seconds72);
+CREATE INDEX hf_events_hfid ON hf_events (hfid);
+CREATE INDEX hf_events_event_id ON hf_events (event_id);
+CREATE INDEX site_events_site_id ON site_events (site_id);
+CREATE INDEX site_events_event_id ON site_events (event_id);
+"""
+
+def coords_text(coords):
+    # back to the "x,y|x,y" form for the coords TEXT columns
+    if coords is None or isinstance(coords, str):
+        return coords
+    return '|'.join(f"{coords[i]},{coords[i + 1]}" for i in range(0, len(coords) - 1, 2))
+
+def region_coords_text(region):
+    if 'coord_runs' in region:
+        return coords_text(expand_coord_runs(region['coord_runs']))
+    return coords_text(region.get('coords'))
+
+def sqlite_rows(queen_json, translated):
+    # walks the placed world once and yields (table, row) in insert order
+    for region in queen_json['regions']:
+        yield 'regions', (id_key(region['id']), region.get('name'), region.get('type'), region_coords_text(region))
+    for region in queen_json['underground_regions']:
+        yield 'underground_regions', (id_key(region['id']), region.get('type'), id_key(region.get('depth')), region_coords_text(region))
+
+    hf_fields_left_out = ('books', 'historical_events', 'assigned')
+    # an hf inhabiting several structures shows up more than once, the first placement wins
+    seen_hfs = set()
+    def placed_hf_rows(hfs, site_id, structure_id):
+        for hf in hfs:
+            if id(hf) in seen_hfs:
+                continue
+            seen_hfs.add(id(hf))
+            data = json.dumps({k: v for k, v in hf.items() if k not in hf_fields_left_out}, ensure_ascii=False)
+            yield 'historical_figures', (id_key(hf['id']), hf.get('name'), hf.get('race'), site_id, structure_id, data)
+            for book in hf.get('books', []):
+                yield 'books', book_row(book, site_id, structure_id, id_key(hf['id']))
+            for event_id in hf.get('historical_events', []):
+                yield 'hf_events', (id_key(hf['id']), id_key(event_id))
+
+    def book_row(book, site_id, structure_id, holder_hfid):
+        return (id_key(book.get('written_content_id')), book.get('title'), id_key(book.get('author_hfid')),
+                book.get('text_content'), site_id, structure_id, holder_hfid)
+
+    for site in queen_json['sites']:
+        site_id = id_key(site['id'])
+        yield 'sites', (site_id, site.get('name'), site.get('type'), coords_text(site.get('coords')), site.get('rectangle'),
+                        id_key(site.get('civ_id')), id_key(site.get('cur_owner_id')))
+        for structure in site.get('structures', []):
+            structure_id = id_key(structure.get('id', structure.get('local_id')))
+            yield 'structures', (site_id, structure_id, structure.get('type'), structure.get('name'))
+            yield from placed_hf_rows(structure.get('historical_figures', []), site_id, structure_id)
+            for book in structure.get('books', []):
+                yield 'books', book_row(book, site_id, structure_id, None)
+        yield from placed_hf_rows(site.get('historical_figures', []), site_id, None)
+        for book in site.get('books', []):
+            yield 'books', book_row(book, site_id, None, None)
+        for event_id in site.get('historical_events', []):
+            yield 'site_events', (site_id, id_key(event_id))
+
+    # queen_json only has the events that got a string, the hf/site events point at all of them,
+    # so the rows come from the chunk times (-1 is a missing year/seconds72) and string is NULL when there is none
+    strings = {id_key(event['id']): event['string'] for event in queen_json['historical_events']}
+    for event_times in (chunk[3] for chunk in translated):
+        for event_id, year, seconds72 in zip(*event_times):
+            yield 'historical_events', (event_id, year if year != -1 else None, seconds72 if seconds72 != -1 else None,
+                                        strings.get(event_id))
+
+def write_sqlite_world(queen_json, translated, json_path):
+    os.makedirs(json_path, exist_ok=True)
+    db_path = os.path.join(json_path, 'world.sqlite')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = sqlite3.connect(db_path)
+    try:
+        # its a one shot bulk load of a file we can always regenerate, no need for a journal
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        db.executescript(SQLITE_SCHEMA)
+        batches = {}
+        def flush(table):
+            rows = batches.pop(table)
+            db.executemany(f"INSERT OR IGNORE INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        for table, row in sqlite_rows(queen_json, translated):
+            batches.setdefault(table, []).append(row)
+            if len(batches[table]) >= 10000:
+                flush(table)
+        for table in list(batches):
+            flush(table)
+        db.executescript(SQLITE_INDEXES)
+        db.commit()
+    finally:
+        db.close()
+
+
+# ---------- RUN REPORT ----------- #
+# wall time, cpu time and record counts for every stage, written as run_report.json next to queen.json so runs
+# can be compared across worlds and versions. --profile-memory adds the tracemalloc peak and gc object counts,
+# its off by default since tracing every allocation makes the conversion a lot slower
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+class RunReport:
+    """Per stage measurements of one conversion run. stages can run inside each other (a stage pulling in the
+    one before it), each one is only charged for its own time."""
+
+    def __init__(self, profile_memory=False):
+        self.profile_memory = profile_memory
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages = []
+        self.open_stages = []
+        self.info = {}
+        if profile_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        if self.profile_memory and self.open_stages:
+            parent = self.open_stages[-1]
+            parent['tracemalloc_peak'] = max(parent['tracemalloc_peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'stage': name, 'counts': {}, 'child_wall': 0.0, 'child_cpu': 0.0, 'tracemalloc_peak': 0}
+        self.open_stages.append(frame)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield frame['counts']
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            self.open_stages.pop()
+            if self.open_stages:
+                self.open_stages[-1]['child_wall'] += wall
+                self.open_stages[-1]['child_cpu'] += cpu
+            record = {'stage': name,
+                      'wall_seconds': round(wall - frame['child_wall'], 3),
+                      'cpu_seconds': round(cpu - frame['child_cpu'], 3)}
+            record.update(frame['counts'])
+            if 'events' in frame['counts'] and record['wall_seconds'] > 0:
+                record['events_per_second'] = round(frame['counts']['events'] / record['wall_seconds'])
+            if self.profile_memory:
+                peak = max(frame['tracemalloc_peak'], tracemalloc.get_traced_memory()[1])
+                record['tracemalloc_peak_mb'] = round(peak / (1024 * 1024), 1)
+                record['gc_objects'] = len(gc.get_objects())
+                if self.open_stages:
+                    parent = self.open_stages[-1]
+                    parent['tracemalloc_peak'] = max(parent['tracemalloc_peak'], peak)
+            self.stages.append(record)
+
+    def count(self, **counts):
+        # adds counts to the innermost stage that is running
+        self.open_stages[-1]['counts'].update(counts)
+
+    def write(self, path):
+        report = {'started': self.started}
+        report.update(self.info)
+        report['stages'] = self.stages
+        report['wall_seconds'] = round(time.perf_counter() - self.start_wall, 3)
+        # worker processes of the event pool arent in here, only this process
+        report['cpu_seconds'] = round(time.process_time() - self.start_cpu, 3)
+        report['peak_rss_mb'] = peak_rss_mb()
+        if self.profile_memory:
+            report['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            tracemalloc.stop()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+
+# ---------- STAGE CACHE ----------- #
+# every stage pickles its result under a hash of its inputs, so rerunning after e.g. enhanced_books.json got
+# more text only redoes book placement and the output instead of parsing the xmls and the events again
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+_converter_digest = None
+
+def converter_digest():
+    # any edit to this script (event tables, formatters, projections...) can change what a stage produces,
+    # so the script itself is part of every key and old cache entries stop matching on their own
+    global _converter_digest
+    if _converter_digest is None:
+        _converter_digest = file_digest(os.path.abspath(__file__))
+    return _converter_digest
+
+def cache_key(*parts):
+    return hashlib.sha256(repr((converter_digest(),) + parts).encode('utf-8')).hexdigest()
+
+class StageCache:
+    """On disk results of the pipeline stages, one entry per stage (a new key replaces the old one)."""
+
+    def __init__(self, cache_path, report, enabled=True):
+        self.cache_path = cache_path
+        self.report = report
+        self.enabled = enabled
+        if enabled:
+            os.makedirs(cache_path, exist_ok=True)
+
+    def entry_path(self, stage, key, extension='pickle'):
+        return os.path.join(self.cache_path, f'{stage}-{key[:16]}.{extension}')
+
+    def has(self, stage, key, extension='pickle'):
+        return self.enabled and os.path.exists(self.entry_path(stage, key, extension))
+
+    def drop_stale(self, stage, keep):
+        for entry in os.listdir(self.cache_path):
+            if entry.startswith(f'{stage}-') and os.path.join(self.cache_path, entry) != keep:
+                os.remove(os.path.join(self.cache_path, entry))
+
+    def run(self, stage, key, compute):
+        path = self.entry_path(stage, key)
+        with self.report.stage(stage) as counts:
+            if self.has(stage, key):
+                print(f"- {stage}: cached")
+                counts['cached'] = True
+                with open(path, 'rb') as f:
+                    return pickle.load(f)
+            result = compute()
+            if self.enabled:
+                with open(path + '.tmp', 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path + '.tmp', path)
+                self.drop_stale(stage, path)
+            return result
+
+    def mark(self, stage, key):
+        # for stages whose result lives somewhere else (the output files), just remember the key
+        if self.enabled:
+            path = self.entry_path(stage, key, 'done')
+            open(path, 'w').close()
+            self.drop_stale(stage, path)
+
+
+def run_pipeline(files_path, json_path, workers=1, indent=4, sharded=False, sqlite=False, use_cache=True, profile_memory=False,
+                 seed=0, fields='full', precompress=True, tiles=False, tile_size=TILE_SIZE, search_index=False,
+                 write_timeline_file=False):
+    report = RunReport(profile_memory)
+    world_files = find_world_files(files_path)
+    report.info['files'] = {name: {'file': os.path.basename(path), 'mb': round(os.path.getsize(path) / (1024 * 1024), 1)}
+                            for name, path in world_files.items() if path}
+    report.info['options'] = {'fields': fields, 'seed': seed, 'workers': workers, 'indent': indent, 'sharded': sharded, 'sqlite': sqlite,
+                              'precompress': precompress, 'tiles': tile_size if tiles else None,
+                              'search_index': search_index, 'timeline': write_timeline_file, 'cache': use_cache}
+    cache = StageCache(os.path.join(json_path, 'cache'), report, use_cache)
+
+    with report.stage('hash inputs'):
+        legends_digest = file_digest(world_files['legends'])
+        legends_key = cache_key('legends', legends_digest, fields)
+        legends_plus_key = cache_key('legends_plus', file_digest(world_files['legends_plus']))
+        merge_key = cache_key('merge', legends_key, legends_plus_key)
+        place_hfs_key = cache_key('place_hfs', merge_key)
+        place_books_key = cache_key('place_books', place_hfs_key, file_digest(world_files['books']), seed)
+        events_key = cache_key('events', legends_digest, seed) # events dont depend on --fields
+        output_key = cache_key('output', place_books_key, events_key, indent, sharded, sqlite, precompress, brotli is not None,
+                               tile_size if tiles else None, search_index, write_timeline_file)
+
+    output_file = os.path.join(json_path, 'world', 'manifest.json') if sharded else os.path.join(json_path, 'queen.json')
+    if cache.has('output', output_key, 'done') and os.path.exists(output_file):
+        print("nothing changed, output is up to date")
+        report.info['up_to_date'] = True
+        report.write(os.path.join(json_path, 'run_report.json'))
+        return
+
+    # stages only run (or load from the cache) when a later stage actually needs them
+    loaded = {}
+    def legends():
+        if 'legends' not in loaded:
+            def parse():
+                legends = load_legends(world_files['legends'], fields)
+                report.count(**{section: len(records) for section, records in legends.items() if isinstance(records, list)})
+                return legends
+            loaded['legends'] = cache.run('legends', legends_key, parse)
+        return loaded['legends']
+
+    # the two xmls dont depend on each other, so when both have to be parsed legends_plus goes to a second
+    # process while this one does legends.xml. only its projected records come back
+    merge_cached = any(cache.has(stage, key) for stage, key in
+                       (('place_books', place_books_key), ('place_hfs', place_hfs_key), ('merge', merge_key)))
+    parse_both = not merge_cached and not cache.has('legends', legends_key) and not cache.has('legends_plus', legends_plus_key)
+    plus_pool = None
+    if parse_both and (os.cpu_count() or 1) > 1:
+        plus_pool = multiprocessing.Pool(1)
+        plus_loading = plus_pool.apply_async(load_legends_plus, (world_files['legends_plus'],))
+
+    def legends_plus():
+        if plus_pool:
+            report.count(parallel=True)
+            return plus_loading.get()
+        return load_legends_plus(world_files['legends_plus'])
+
+    def merge():
+        legends_records = legends() # first, so it overlaps with legends_plus parsing in the other process
+        legends_plus_records = cache.run('legends_plus', legends_plus_key, legends_plus)
+        hf_index.clear()
+        queen_json = merge_world(legends_records, legends_plus_records)
+        report.count(sites=len(queen_json['sites']), regions=len(queen_json['regions']))
+        return {'queen_json': queen_json, 'historical_figures': legends()['historical_figures'],
+                'hf_index': hf_index, 'artifacts_by_wc': index_artifacts_by_written_content(legends()['artifacts'])}
+
+    def place_hfs():
+        world = cache.run('merge', merge_key, merge)
+        restore_world_indexes(world)
+        report.count(**place_historical_figures(world['queen_json'], world['historical_figures']))
+        del world['historical_figures'] # everything we need from here on is placed in queen_json
+        return world
+
+    def place():
+        world = cache.run('place_hfs', place_hfs_key, place_hfs)
+        restore_world_indexes(world)
+        report.count(**place_books(world['queen_json'], load_books(world_files['books']), world['artifacts_by_wc'], seed))
+        return world
+
+    def translate():
+        translated = translate_events(legends(), workers, seed)
+        report.count(events=len(legends()['historical_events']),
+                     event_strings=sum(len(chunk[0]) for chunk in translated))
+        return translated
+
+    try:
+        world = cache.run('place_books', place_books_key, place)
+    finally:
+        if plus_pool:
+            plus_pool.terminate()
+            plus_pool.join()
+    restore_world_indexes(world)
+    queen_json = world['queen_json']
+    translated = cache.run('events', events_key, translate)
+    with report.stage('link events'):
+        timeline = link_events(queen_json, translated)
+
+    if sqlite:
+        with report.stage('write sqlite'):
+            write_sqlite_world(queen_json, translated, json_path)
+    with report.stage('build cell grid'):
+        grid = build_cell_grid(queen_json)
+    if tiles:
+        with report.stage('write tiles'):
+            report.count(**write_tiles(queen_json, grid, json_path, sharded, tile_size))
+    else:
+        remove_tiles(json_path, sharded) # dont leave tiles of an older output around
+    if write_timeline_file:
+        with report.stage('write timeline'):
+            report.count(**write_timeline(queen_json, timeline, json_path, sharded))
+    else:
+        remove_timeline(json_path, sharded)
+    if search_index:
+        with report.stage('write search index'):
+            report.count(**write_search_index(queen_json, json_path, sharded))
+    else:
+        remove_search_index(json_path, sharded)
+    with report.stage('write output'):
+        if sharded:
+            write_sharded_world(queen_json, json_path, indent)
+        else:
+            write_queen_json(queen_json, json_path, indent)
+    # after queen.json so a plain copy of both keeps the grid the newer file
+    with report.stage('write cell grid'):
+        report.count(**write_cell_grid(grid, json_path, sharded))
+    if precompress:
+        with report.stage('precompress output'):
+            report.count(**precompress_output(json_path, sharded))
+    else:
+        for path in output_json_files(json_path, sharded):
+            remove_precompressed(path) # dont leave variants of an older output around
+    cache.mark('output', output_key)
+    report.write(os.path.join(json_path, 'run_report.json'))
+
+def restore_world_indexes(world):
+    # a world coming out of the cache brings its own copies of the hfs, point the lookups at those
+    if world['hf_index'] is not hf_index:
+        hf_index.clear()
+        hf_index.update(world['hf_index'])
+        world['hf_index'] = hf_index
+    index_sites_by_entity(world['queen_json']['sites'])
+
+
+# ---------- START CODE EXECUTION ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(description="convert the legends exports + enhanced_books.json into queen.json")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to translate historical events (default 1, no pool)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for connector choice and fallback book placement, same input + seed = same output (default 0)")
+    parser.add_argument('--fields', choices=list(FIELD_PROFILES), default='full',
+                        help="which record fields go into the output: full (default), web-minimal or analysis")
+    parser.add_argument('--compact', action='store_true',
+                        help="write queen.json without indentation")
+    parser.add_argument('--sharded', action='store_true',
+                        help="write jsons/world/ (manifest + one file per site + event chunks) instead of queen.json")
+    parser.add_argument('--sqlite', action='store_true',
+                        help="also write jsons/world.sqlite with indexed tables of the converted world")
+    parser.add_argument('--tiles', action='store_true',
+                        help="also write the map as tiles/ of --tile-size x --tile-size cells with an index.json of summaries")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE,
+                        help=f"cells per tile side for --tiles (default {TILE_SIZE})")
+    parser.add_argument('--timeline', action='store_true',
+                        help="also write timeline.json, all events in time order with per year offsets and per hf/site positions")
+    parser.add_argument('--search-index', action='store_true',
+                        help="also write search/ with a token index over hf, site and book names, book texts and event strings")
+    parser.add_argument('--no-precompress', action='store_true',
+                        help="dont write the .gz/.br copies of the output jsons (.br needs the brotli module)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="dont read or write the stage cache in jsons/cache/")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="add tracemalloc peaks and gc object counts per stage to run_report.json (slow)")
+    args = parser.parse_args()
+    if args.tile_size < 1:
+        parser.error('--tile-size must be at least 1')
+
+    os.makedirs(JSON_PATH, exist_ok=True)
+    run_pipeline(FILES_PATH, JSON_PATH, workers=args.workers, indent=None if args.compact else 4,
+                 sharded=args.sharded, sqlite=args.sqlite, use_cache=not args.no_cache,
+                 profile_memory=args.profile_memory, seed=args.seed, fields=args.fields,
+                 precompress=not args.no_precompress, tiles=args.tiles, tile_size=args.tile_size,
+                 search_index=args.search_index, write_timeline_file=args.timeline)
+    print("done, queen! .json <3")
 
-        hf = get_hf_by_id(hf_id)
-        if not hf: continue
-        if 'historical_events' not in hf:
-            hf['historical_events'] = []
-        hf['historical_events'].append(event['id'])
-    for k, site_id in event_data['site_links']:
-        site = queen_json['sites'][int(site_id)-1]
-        if 'historical_events' not in site:
-            site['historical_events'] = []
-        site['historical_events'].append(event['id'])
-    
-if not os.path.exists(JSON_PATH):
-    os.mkdir(JSON_PATH)
-
-with open(f'{JSON_PATH}/queen.json', 'w', encoding='utf-8') as f:
-    json.dump(queen_json, f, ensure_ascii=False, indent=4)
-
-with open(f'{JSON_PATH}/queen.json', encoding="utf-8") as f:
-    s = f.read()
-
-with open(f'{JSON_PATH}/queen.json', 'w', encoding="utf-8") as f:
-    s = s.replace("the the", "the")
-    s = s.replace("the The", "the")
-    s = s.replace("The the", "The")
-    s = s.replace("The The", "The")
-    f.write(s)
-print("done, queen! .json <3")
\ No newline at end of file
+if __name__ == '__main__':
+    main()